@@ -0,0 +1,407 @@
+import argparse
+import cPickle
+import random
+import shutil
+import sys
+import tempfile
+from timeit import default_timer as timer
+from game import *
+
+
+class Benchmark():
+  """
+    Micro benchmarks for the hot paths of the framework.
+    A midgame position is reached by seeded random play so the numbers are comparable between runs.
+  """
+  BENCHMARKS = ['lookup', 'entrypoints', 'validmoves', 'transposed', 'staged', 'allocations', 'replay', 'snapshot', 'diskcache', 'snake', 'slides', 'planes', 'evaluation', 'transpositions']
+
+  def __init__(self, args):
+    self.args = self._parseArgs(args)
+
+
+  def _parseArgs(self, args):
+    parser = argparse.ArgumentParser(prog='benchmark', argument_default='')
+    parser.add_argument(args[0], default='')
+    parser.add_argument('--plies', type=int, default=24) # number of random moves played to reach the position
+    parser.add_argument('--seed', type=int, default=22)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--expansions', default='') # LM
+    parser.add_argument('--only', default='') # comma separated benchmark names
+    parser.add_argument('--snake', type=int, default=26) # length of the hive used by the traversal benchmark
+    args = parser.parse_args(args)
+    return vars(args)
+
+
+  def setupGame(self, plies = None, isNotated = False):
+    """ random play from the seed, optionally through playMove so the game keeps its move list """
+    rand = random.Random(self.args['seed'])
+    game = Game('', '', '600000,0,0', '', self.args['expansions'])
+    for i in range(plies or self.args['plies']):
+      validMoves = game.getValidMoves()
+      if not validMoves or game.isGameOver():
+        break
+      validMoves.sort(key=lambda move: (move.piece.getNotation(), move.endPoint))
+      move = rand.choice(validMoves)
+      if isNotated:
+        game.playMove(game.getMoveNotation(move))
+      else:
+        game.makeMove(move)
+    return game
+
+
+  def run(self):
+    names = self.args['only'].split(',') if self.args['only'] else Benchmark.BENCHMARKS
+    for name in names:
+      game = self.setupGame()
+      function = getattr(self, 'benchmark' + name.capitalize())
+      result = function(game, self.args['repeat'])
+      if result: # benchmarks with several parts report them as they go
+        self.report(name, *result)
+
+
+  def report(self, name, iterations, elapsed):
+    sys.stdout.write('%-16s %8d iterations %12.3f us/iteration\n' % (name, iterations, elapsed * 1000000 / iterations))
+
+
+  def benchmarkLookup(self, game, repeat):
+    """ getTopPieceAtPoint over every hex in and around the hive """
+    hive = game.hive
+    limits = hive.getBoardArrayLimits()
+    points = []
+    for arry in range(limits[1] - 1, limits[3] + 2):
+      for arrx in range(limits[0] - 1, limits[2] + 2):
+        points.append(Point(arrx - (arry >> 1), arrx + ((arry + 1) >> 1), 0))
+
+    startTime = timer()
+    for i in xrange(repeat):
+      for point in points:
+        hive.getTopPieceAtPoint(point)
+    return (repeat * len(points), timer() - startTime)
+
+
+  def benchmarkEntrypoints(self, game, repeat):
+    """ Hive.getEntryPoints for both colors """
+    hive = game.hive
+    startTime = timer()
+    for i in xrange(repeat):
+      hive.getEntryPoints('w')
+      hive.getEntryPoints('b')
+    return (repeat, timer() - startTime)
+
+
+  def benchmarkValidmoves(self, game, repeat):
+    """ Game.getValidMoves for the side to move, generated each time and answered from the caches """
+    startTime = timer()
+    for i in xrange(repeat):
+      self.clearCaches(game)
+      game.getValidMoves()
+    self.report('validmoves', repeat, timer() - startTime)
+
+    startTime = timer()
+    for i in xrange(repeat):
+      game.getValidMoves()
+    self.report('validmoves.cached', repeat, timer() - startTime)
+
+
+  def benchmarkTransposed(self, game, repeat):
+    """
+      Game.getValidMoves from moveCache after two ants of the side to move were placed onto each other's cells
+      (the same Zobrist state); every move must be of the piece on its start cell, else this stops with an error
+    """
+    game = Game('', '', '600000,0,0', '1. wQ, 2. bQ -wQ, 3. wB1 wQ\\, 4. bB1 -bQ', self.args['expansions'])
+    entryPoints = game.hive.getEntryPoints('w')[:2]
+    for (firstAnt, secondAnt) in (('A1', 'A2'), ('A2', 'A1')):
+      moves = []
+      for (key, point) in zip((firstAnt, secondAnt), entryPoints):
+        piece = game.currentPlayer.pieces[key]
+        moves.append(Move(piece, piece.point, point))
+        game.makeMove(moves[-1])
+        moves.append([move for move in game.getValidMoves() if move.startPoint == Point.NONE][0]) # a placement keeps white to move
+        game.makeMove(moves[-1])
+      wrongMoves = [move for move in game.getValidMoves() if not move.startPoint == move.piece.point]
+      if wrongMoves:
+        raise AssertionError('moveCache gave moves of the wrong pieces: ' + ', '.join([move.piece.getNotation() for move in wrongMoves]))
+      if firstAnt == 'A1': # the second placement order stays on the board for the timing
+        for move in reversed(moves):
+          game.unmakeMove(move)
+
+    if game.moveCache.hits == 0:
+      raise AssertionError('moveCache missed the transposed position')
+
+    startTime = timer()
+    for i in xrange(repeat):
+      game.getValidMoves()
+    return (repeat, timer() - startTime)
+
+
+  def clearCaches(self, game):
+    game.moveCache.clear()
+    game.hive.analysisCache.clear()
+
+
+  def benchmarkStaged(self, game, repeat):
+    """ Game.generateValidMoves: the first move (a cutoff on it skips the rest) and all of them """
+    startTime = timer()
+    for i in xrange(repeat):
+      self.clearCaches(game)
+      next(game.generateValidMoves())
+    self.report('staged.first', repeat, timer() - startTime)
+
+    startTime = timer()
+    for i in xrange(repeat):
+      self.clearCaches(game)
+      list(game.generateValidMoves())
+    self.report('staged.all', repeat, timer() - startTime)
+
+
+  def benchmarkAllocations(self, game, repeat):
+    """ Game.getValidMoves while counting the Point objects it allocates """
+    counter = [0]
+    pointNew = Point.__new__
+    def countingNew(cls, x, y, z):
+      counter[0] += 1
+      return pointNew(cls, x, y, z)
+
+    Point.__new__ = staticmethod(countingNew)
+    try:
+      startTime = timer()
+      for i in xrange(repeat):
+        self.clearCaches(game)
+        game.getValidMoves()
+      elapsed = timer() - startTime
+    finally:
+      Point.__new__ = staticmethod(pointNew)
+
+    sys.stdout.write('%-16s %8d points allocated per getValidMoves\n' % ('', counter[0] / repeat))
+    return (repeat, elapsed)
+
+
+  def benchmarkReplay(self, game, repeat):
+    """ Rebuilding a Game from --moves of increasing length, validated and trusted """
+    moveList = self.setupGame(100, True).moveList
+    repeat = max(1, repeat / 20)
+    for length in (25, 50, 100):
+      moveListCsv = ', '.join(moveList[:length])
+      startTime = timer()
+      for i in xrange(repeat):
+        Game('', '', '600000,0,0', moveListCsv, self.args['expansions'])
+      self.report('replay' + str(length), repeat, timer() - startTime)
+
+      startTime = timer()
+      for i in xrange(repeat):
+        Game('', '', '600000,0,0', moveListCsv, self.args['expansions'], True)
+      self.report('replay' + str(length) + '.trusted', repeat, timer() - startTime)
+
+
+  def benchmarkSnapshot(self, game, repeat):
+    """ Taking a Snapshot, rebuilding a Game from it and its pickled size """
+    startTime = timer()
+    for i in xrange(repeat):
+      snapshot = game.getSnapshot()
+    self.report('snapshot.take', repeat, timer() - startTime)
+
+    startTime = timer()
+    for i in xrange(repeat):
+      Game.fromSnapshot(snapshot)
+    self.report('snapshot.restore', repeat, timer() - startTime)
+    sys.stdout.write('%-16s %8d bytes pickled\n' % ('', len(cPickle.dumps(snapshot, cPickle.HIGHEST_PROTOCOL))))
+
+
+  def benchmarkDiskcache(self, game, repeat):
+    """ Resuming a Game of 100 moves from the DiskCache entry saved two moves earlier, as a bot started each turn would """
+    moveList = self.setupGame(100, True).moveList
+    moveListCsv = ', '.join(moveList)
+    repeat = max(1, repeat / 20)
+    directory = tempfile.mkdtemp()
+    try:
+      diskCache = DiskCache(directory)
+      Game('', '', '600000,0,0', ', '.join(moveList[:-2]), self.args['expansions']).saveToDiskCache(diskCache, 'benchmark')
+      startTime = timer()
+      for i in xrange(repeat):
+        Game.fromDiskCache(diskCache, 'benchmark', '', '', '600000,0,0', moveListCsv, self.args['expansions'])
+      self.report('diskcache.resume', repeat, timer() - startTime)
+    finally:
+      shutil.rmtree(directory)
+
+
+  def benchmarkSnake(self, game, repeat):
+    """ The hive traversals on a long, one piece wide hive (the worst case for depth) """
+    hive = Hive()
+    for i in range(self.args['snake']):
+      hive.putdownPiece(AntPiece('wb'[i % 2], i % 3 + 1), Point(i, i / 2, 0))
+    headCell = hive.getCellId(Point(0, 0, 0))
+    tailCell = hive.getCellId(Point(self.args['snake'] - 1, (self.args['snake'] - 1) / 2, 0))
+
+    traversals = [
+      ('traverseHive', lambda: hive.traverseHive(headCell)),
+      ('pinnedCells', lambda: hive._findPinnedCells()),
+      ('perimeter', lambda: hive._findPerimeterComponents()),
+      ('slideReach', lambda: (hive.analysisCache.clear(), hive.getSlideReachableCells(tailCell))),
+    ]
+    for name, traversal in traversals:
+      startTime = timer()
+      for i in xrange(repeat):
+        traversal()
+      self.report('snake.' + name, repeat, timer() - startTime)
+
+
+  def benchmarkSlides(self, game, repeat):
+    """
+      Hive.getSlideReachableCells against the plain walk of the perimeter with the piece lifted (traversePerimeter)
+      for every piece free to move after every move of 100 random games, then the speed of both in the benchmark position
+    """
+    for seed in range(self.args['seed'], self.args['seed'] + 100):
+      rand = random.Random(seed)
+      randomGame = Game('', '', '600000,0,0', '', self.args['expansions'])
+      for i in range(self.args['plies'] * 3):
+        validMoves = randomGame.getValidMoves()
+        if not validMoves or randomGame.isGameOver():
+          break
+        validMoves.sort(key=lambda move: (move.piece.getNotation(), move.endPoint))
+        randomGame.makeMove(rand.choice(validMoves))
+        self.checkSlides(randomGame.hive)
+
+    hive = game.hive
+    cells = self.checkSlides(hive)
+    startTime = timer()
+    for i in xrange(repeat):
+      hive.analysisCache.clear()
+      for cellId in cells:
+        hive.getSlideReachableCells(cellId)
+    self.report('slides', repeat, timer() - startTime)
+
+    startTime = timer()
+    for i in xrange(repeat):
+      for cellId in cells:
+        hive.traversePerimeter(cellId, hive.getLiftedMasks(cellId))
+    self.report('slides.traverse', repeat, timer() - startTime)
+
+
+  def checkSlides(self, hive):
+    """ the cells of the pieces checked: alone on their cell and not pinned """
+    pinnedCells = hive.getPinnedCells()
+    cells = [cellId for cellId, pieces in hive.board.iteritems() if len(pieces) == 1 and not cellId in pinnedCells]
+    for cellId in cells:
+      expectedCells = hive.traversePerimeter(cellId, hive.getLiftedMasks(cellId))
+      expectedCells.discard(cellId)
+      reachableCells = hive.getSlideReachableCells(cellId)
+      if not reachableCells == expectedCells:
+        raise AssertionError('getSlideReachableCells from %s differs from the perimeter walk at %s' % (str(hive.getCellPoint(cellId)),
+          ', '.join([str(hive.getCellPoint(otherCell)) for otherCell in reachableCells ^ expectedCells])))
+    return cells
+
+
+  def benchmarkPlanes(self, game, repeat):
+    """
+      BoardPlanes against the Hive it mirrors: the adjacent and queen bee counts and the tropism after every move of a
+      random game and its unmaking, and along a snake long enough to re-centre the window; then the features' speed
+    """
+    if not numpy:
+      sys.stdout.write('%-16s skipped, BoardPlanes needs NumPy\n' % 'planes')
+      return
+
+    rand = random.Random(self.args['seed'])
+    game = Game('', '', '600000,0,0', '', self.args['expansions'])
+    planes = game.hive.enablePlanes()
+    moves = []
+    for i in range(self.args['plies'] * 2):
+      validMoves = game.getValidMoves()
+      if not validMoves or game.isGameOver():
+        break
+      validMoves.sort(key=lambda move: (move.piece.getNotation(), move.endPoint))
+      moves.append(rand.choice(validMoves))
+      game.makeMove(moves[-1])
+      self.checkPlanes(game.hive, planes)
+    for move in reversed(moves):
+      game.unmakeMove(move)
+      self.checkPlanes(game.hive, planes)
+
+    hive = Hive()
+    planes = hive.enablePlanes()
+    for i in range(self.args['snake']):
+      hive.putdownPiece(AntPiece('wb'[i % 2], i % 3 + 1), Point(i, i / 2, 0))
+      self.checkPlanes(hive, planes)
+    if planes.originX == -BoardPlanes.SIZE / 2:
+      raise AssertionError('BoardPlanes did not re-centre on the snake')
+
+    array = game.hive.planes.getArray()
+    startTime = timer()
+    for i in xrange(repeat):
+      getAdjacentCounts(array)
+      getQueenAdjacentCounts(array)
+      getTropism(array, 1, self.getTropismTables())
+    return (repeat, timer() - startTime)
+
+
+  def getTropismTables(self):
+    import drone
+    return {'S': drone.Heuristic.SPIDER_TROPISM, 'A': drone.Heuristic.ANT_TROPISM, 'B': drone.Heuristic.BEETLE_TROPISM, 'G': drone.Heuristic.GRASSHOPPER_TROPISM}
+
+
+  def checkPlanes(self, hive, planes):
+    array = planes.getArray()
+    counts = getAdjacentCounts(array)
+    cells = set(hive.board)
+    for cellId in hive.board:
+      cells.update([cellId + offset for offset in Hive.ADJACENT_OFFSETS])
+    for cellId in cells:
+      point = hive.getCellPoint(cellId)
+      (i, j) = (point.x - planes.originX, point.y - planes.originY)
+      if not (0 <= i < BoardPlanes.SIZE and 0 <= j < BoardPlanes.SIZE):
+        raise AssertionError('BoardPlanes window does not cover ' + str(point))
+      if not counts[i, j] == hive.getAdjacentCount(cellId):
+        raise AssertionError('BoardPlanes adjacent count differs at ' + str(point))
+    if array[BoardPlanes.OCCUPANCY].sum() != len(hive.board):
+      raise AssertionError('BoardPlanes has %d occupied cells, the hive %d' % (array[BoardPlanes.OCCUPANCY].sum(), len(hive.board)))
+
+    queenCounts = getQueenAdjacentCounts(array)
+    if not (queenCounts[0], queenCounts[1]) == (hive.getQueenAdjacentCount('w'), hive.getQueenAdjacentCount('b')):
+      raise AssertionError('BoardPlanes queen bee counts %s differ from the hive\'s' % (queenCounts,))
+
+    tables = self.getTropismTables()
+    for (color, sign) in (('w', 1), ('b', -1)):
+      opposingQueenCell = hive.queenCells.get('b' if color == 'w' else 'w')
+      tropism = 0
+      for cellId, pieces in hive.board.iteritems():
+        if pieces[-1].color == color and pieces[-1].kind in tables:
+          table = tables[pieces[-1].kind]
+          distance = len(table) - 1 if opposingQueenCell is None else hive.getDistanceBetweenPoints(hive.getCellPoint(cellId), hive.getCellPoint(opposingQueenCell))
+          tropism += table[min(distance, len(table) - 1)]
+      if not getTropism(array, sign, tables) == tropism:
+        raise AssertionError('BoardPlanes tropism %d differs from the hive\'s %d' % (getTropism(array, sign, tables), tropism))
+
+
+  def benchmarkEvaluation(self, game, repeat):
+    """ drone's Heuristic.evaluate, first on openings with one or both queen bees still in the pile (it must not fail there) """
+    import drone
+    for moveListCsv in ('1. wS1', '1. wS1, 2. bG1 -wS1', '1. wS1, 2. bQ -wS1, 3. wA1 wS1/'):
+      openingGame = Game('', '', '600000,0,0', moveListCsv, self.args['expansions'])
+      drone.Heuristic(openingGame).evaluate()
+
+    heuristic = drone.Heuristic(game)
+    startTime = timer()
+    for i in xrange(repeat):
+      heuristic.evaluate()
+    return (repeat, timer() - startTime)
+
+
+  def benchmarkTranspositions(self, game, repeat):
+    """ Transposition table hit rate of a depth 3 drone search, with that of the analysis cache """
+    import drone
+    fixedDepth = drone.MoveSearch.FIXED_DEPTH
+    drone.MoveSearch.FIXED_DEPTH = 3
+    try:
+      search = drone.MoveSearch(self.setupGame())
+      startTime = timer()
+      search.findMove()
+      elapsed = timer() - startTime
+      table = search.transpositionTable
+      sys.stdout.write('%-16s %8d probes %7.1f%% hits %10.3f s/search\n' % ('transpositions', table.probes, 100.0 * table.hits / table.probes, elapsed))
+      cache = search.game.hive.analysisCache
+      sys.stdout.write('%-16s %8d lookups %6.1f%% hits\n' % ('  analyses', cache.hits + cache.misses, 100.0 * cache.getHitRate()))
+    finally:
+      drone.MoveSearch.FIXED_DEPTH = fixedDepth
+
+
+if __name__ == "__main__":
+  Benchmark(sys.argv).run()
@@ -0,0 +1,119 @@
+import cPickle
+import hashlib
+import os
+
+_MISSING = object()
+
+class LRUCache:
+  """
+    A bounded cache that forgets the least recently used entries first, with hit and miss counters.
+    The recency is kept in two generations of plain dicts rather than a linked list, so a lookup costs one or two dict operations:
+    new entries and hits go to the young generation, and once it holds capacity entries it replaces the old one (dropping whatever
+    was not used since). At most 2 * capacity entries are kept.
+  """
+
+  def __init__(self, capacity):
+    self.capacity = capacity
+    self.young = dict()
+    self.old = dict()
+    self.hits = 0
+    self.misses = 0
+
+
+  def get(self, key, default = None):
+    value = self.young.get(key, _MISSING)
+    if value is _MISSING:
+      value = self.old.pop(key, _MISSING)
+      if value is _MISSING:
+        self.misses += 1
+        return default
+      self._store(key, value)
+    self.hits += 1
+    return value
+
+
+  def put(self, key, value):
+    self.old.pop(key, None)
+    self._store(key, value)
+
+
+  def _store(self, key, value):
+    if len(self.young) >= self.capacity and not key in self.young:
+      self.old = self.young
+      self.young = dict()
+    self.young[key] = value
+
+
+  def clear(self):
+    self.young.clear()
+    self.old.clear()
+
+
+  def getHitRate(self):
+    """ the share of the lookups that were hits, 0 before the first """
+    lookups = self.hits + self.misses
+    return float(self.hits) / lookups if lookups else 0.0
+
+
+  def __len__(self):
+    return len(self.young) + len(self.old)
+
+
+
+class DiskCache:
+  """
+    Pickled values in files of a local directory, named by the SHA-1 of their string keys, so that separate processes
+    (e.g. a bot started once per turn) can pick up each other's work. Only the MAX_FILES most recently saved are kept.
+    A missing, partly written or unreadable entry is a miss.
+  """
+  MAX_FILES = 32
+  SUFFIX = '.cache'
+
+  def __init__(self, directory):
+    self.directory = directory
+    if not os.path.isdir(directory):
+      try:
+        os.makedirs(directory)
+      except OSError: # made by another process in the meantime
+        pass
+
+
+  def getPath(self, key):
+    return os.path.join(self.directory, hashlib.sha1(key).hexdigest() + DiskCache.SUFFIX)
+
+
+  def load(self, key):
+    try:
+      with open(self.getPath(key), 'rb') as cacheFile:
+        return cPickle.load(cacheFile)
+    except Exception: # not there, or written by an older version of the code: either way a miss
+      return None
+
+
+  def save(self, key, value):
+    """ writes the value to a file of its own first and renames it into place, so readers never see half an entry """
+    path = self.getPath(key)
+    temporaryPath = '%s.%d.tmp' % (path, os.getpid())
+    with open(temporaryPath, 'wb') as cacheFile:
+      cPickle.dump(value, cacheFile, cPickle.HIGHEST_PROTOCOL)
+    if os.name == 'nt' and os.path.exists(path): # rename does not replace files on Windows
+      os.remove(path)
+    os.rename(temporaryPath, path)
+    self._evict()
+
+
+  def _evict(self):
+    paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(DiskCache.SUFFIX)]
+    if len(paths) <= DiskCache.MAX_FILES:
+      return
+    modifiedTimes = []
+    for path in paths:
+      try:
+        modifiedTimes.append((os.path.getmtime(path), path))
+      except OSError: # evicted by another process
+        pass
+    for modifiedTime, path in sorted(modifiedTimes)[:-DiskCache.MAX_FILES]:
+      try:
+        os.remove(path)
+      except OSError:
+        pass
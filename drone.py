@@ -3,6 +3,7 @@ import random
 import sys
 from time import time
 from game import *
+from protocol import *
 from collections import namedtuple
 
 
@@ -51,7 +52,7 @@ class OpeningBook():
 
     1. wG1, 2. b__ -wG1, 3. wQ wG1/
     """                                                       
-    if self.game.turnNumber == 3 || self.game.turnNumber == 4:
+    if self.game.turnNumber == 3 or self.game.turnNumber == 4:
       entryPoints = self.game.hive.getEntryPoints(self.game.currentPlayer.color[0])
       return Move(self.game.currentPlayer.pieces['Q'], Point.NONE, entryPoints[0])
 
@@ -60,18 +61,42 @@ class OpeningBook():
 Transposition = namedtuple('Transposition', ['depth', 'value', 'flags', 'move'])
 
 class TranspositionTable():
+  """ Keyed by MoveSearch.getState, with the moves stored as MoveSearch.getTranspositionMove gives them """
   (HASH_EXACT, HASH_BETA, HASH_ALPHA) = (1, 2, 3)
+  KEPT_DEPTH = 1 # the least depth of the records kept for the next turn (the leaf evaluations are most of the table and cheap to redo)
+  KEPT_RECORDS = 2048 # the most records kept for the next turn, the deepest first
 
   def __init__(self):
     self.table = dict()
+    self.probes = 0
+    self.hits = 0
 
 
   def record(self, key, depth, value, flags, move = None):
-    self.table[key] = Transposition(depth, flags, value, move)
+    self.table[key] = Transposition(depth, value, flags, move)
+
+
+  def getRecords(self):
+    """
+      the records worth keeping for the next turn as plain tuples, to pickle (see Game.saveToDiskCache):
+      at least KEPT_DEPTH deep and at most KEPT_RECORDS of them, so they don't grow over the game
+    """
+    records = [(transposition.depth, key, tuple(transposition)) for key, transposition in self.table.iteritems() if transposition.depth >= TranspositionTable.KEPT_DEPTH]
+    if len(records) > TranspositionTable.KEPT_RECORDS:
+      records.sort(reverse=True)
+      del records[TranspositionTable.KEPT_RECORDS:]
+    return dict([(key, record) for depth, key, record in records])
+
+
+  def putRecords(self, records):
+    for key, record in records.iteritems():
+      self.table[key] = Transposition(*record)
 
 
   def probe(self, key, depth, alpha, beta):
+    self.probes += 1
     if self.table.has_key(key):
+      self.hits += 1
       transposition = self.table[key]
       if transposition.depth >= depth:
         if transposition.flags == TranspositionTable.HASH_EXACT:
@@ -89,19 +114,20 @@ class TranspositionTable():
     return None
 
 
-  def collectPrincipleVariation(self, game, depth):
+  def collectPrincipleVariation(self, search, depth):
     principalVariation = []
+    game = search.game
 
     for i in range(depth,-1,-1):
-      key = game.getState()
-      move = self._probeMove(key)
-      if not move:
+      key = search.getState()
+      move = search.findTranspositionMove(self._probeMove(key))
+      if not move or not game.isLegalMove(move):
         break 
       principalVariation.append(move)
       game.makeMove(move)
 
-    for move in principalVariation:
-      board.unmakeMove(move)
+    for move in reversed(principalVariation):
+      game.unmakeMove(move)
 
     return principalVariation
 
@@ -116,11 +142,13 @@ class MoveSearch():
   CONTEMPT_FACTOR = -5
   WIN_SCORE = 2**15 - 1
 
-  def __init__(self, game):
+  def __init__(self, game, transpositionRecords = None):
     self.game = game
     self.horizonDepth = 1
     self.bestMove = None
     self.transpositionTable = TranspositionTable()
+    if transpositionRecords:
+      self.transpositionTable.putRecords(transpositionRecords)
     self.heuristic = Heuristic(game)
     self.numberOfEvaluations = 0;
     self.numberOfNodesOpened = 0;
@@ -161,20 +189,22 @@ class MoveSearch():
 #    isInPrincipleVariation = False
     self.numberOfNodesOpened += 1
 
-    val = self.transpositionTable.probe(self.game.hive.getState(), depth, alpha, beta)
-    if not val == None:
-      return val
+    state = self.getState()
+    if depth < self.horizonDepth: # the root is always searched, a table loaded from the disk cache may already hold its value but not the move to play
+      val = self.transpositionTable.probe(state, depth, alpha, beta)
+      if not val == None:
+        return val
     val = self.checkWinScore(depth)
     if not val == None:
       return val
     if depth <= 0:
       val = self.evaluate()
-      self.transpositionTable.record(self.game.hive.getState(), depth, val, TranspositionTable.HASH_EXACT)
+      self.transpositionTable.record(state, depth, val, TranspositionTable.HASH_EXACT)
       return val
 
-    validMoves = self.getValidMoves()
-    self.orderMoves(validMoves)
-    for move in validMoves:
+    # moves are generated as they are searched, the best move found the last time this position was searched goes first
+    bestMove = None
+    for move in self.generateMoves(self.findTranspositionMove(self.transpositionTable._probeMove(state))):
       self.game.makeMove(move)
 
 #      if isInPrincipleVariation:
@@ -187,20 +217,45 @@ class MoveSearch():
       self.game.unmakeMove(move)
 
       if val >= beta: # our opponent won't let us get to this move, it's too good
-        self.transpositionTable.record(self.game.hive.getState(), depth, beta, TranspositionTable.HASH_BETA, move)
+        self.transpositionTable.record(state, depth, beta, TranspositionTable.HASH_BETA, self.getTranspositionMove(move))
         return beta
 
       if val > alpha: # yea! a better move that we can get to
         alpha = val
 #        isInPrincipleVariation = True
         transpositionFlags = TranspositionTable.HASH_EXACT
+        bestMove = move
         if depth == self.horizonDepth:
           self.bestMove = move
 
-    self.transpositionTable.record(self.game.hive.getState(), depth, alpha, transpositionFlags, self.bestMove)
+    self.transpositionTable.record(state, depth, alpha, transpositionFlags, bestMove and self.getTranspositionMove(bestMove))
     return alpha
 
 
+  def getState(self):
+    return self.game.hive.getState()
+
+
+  def getTranspositionMove(self, move):
+    """ (piece kindId, start, end) of a move for the transposition table """
+    return (move.piece.kindId, move.startPoint, move.endPoint)
+
+
+  def findTranspositionMove(self, transpositionMove):
+    """ the Move that a move stored for the current position (see getTranspositionMove) stands for, or None (it may not be legal after a hash collision) """
+    if not transpositionMove:
+      return None
+    (kindId, startPoint, endPoint) = transpositionMove
+    if startPoint == Point.NONE:
+      pieces = [piece for piece in self.game.getPlacementPieces() if piece.kindId == kindId]
+      piece = pieces[0] if pieces else None
+    else:
+      piece = self.game.hive.getTopPieceAtPoint(startPoint)
+    if not piece or not piece.kindId == kindId:
+      return None
+    return Move(piece, piece.point, endPoint)
+
+
   def checkWinScore(self, depth):
     winner = self.game.getWinner()
     if winner == Game.WINNER_NONE:
@@ -225,7 +280,7 @@ class MoveSearch():
     return signFlip * self.heuristic.evaluate()
 
 
-  def getValidMoves(self):
+  def generateMoves(self, firstMove = None):
     #can edit the valid move list here for testing...
     #piece = self.game.currentPlayer.pieces['B1']
     #moveList = []
@@ -234,21 +289,7 @@ class MoveSearch():
     #
     #sys.stderr.write(str(moveList) + '\n\n')
     #return moveList
-    return self.game.getValidMoves()
-
-
-
-  def orderMoves(self, moveList):
-    """
-      Speed ups:
-        * if more than one of a particular kind of piece in pile, don't check both (could be taken care of in transposition table anyways
-
-      Ideas: 
-        * simpleMobility to sort
-        * if # free pieces < empty hexes around queen: look at adding pieces first:w
-    """
-    moveList.sort(key=lambda move: move.piece.isPlayed())
-    return moveList
+    return self.game.generateValidMoves(firstMove)
 
 
 
@@ -312,44 +353,43 @@ class Heuristic():
     opposingQueen = self.game.whitePlayer.pieces['Q'] if player.color == Player.BLACK else self.game.blackPlayer.pieces['Q']
     queen = player.pieces['Q']
 
-    # entry point eval: better if not near the queen
+    # entry point eval: better if not near the queen (any entry point while the queen is in the pile)
     if player.getNumberOfPiecesToPlay() > 0:
       nonQueenEntryPointCount = 0
       entryPoints = hive.getEntryPoints(player.color[0])
       for entryPoint in entryPoints:
-        if not hive.arePointsAdjacent(entryPoint, queen.point):
+        if not queen.isPlayed() or not hive.arePointsAdjacent(entryPoint, queen.point):
           nonQueenEntryPointCount += 1
       score += nonQueenEntryPointCount * Heuristic.ENTRY_POINT_SCORE
 
     # Queen Evaluation...
-    # pinned factor
-    if queen.isPinned(hive):
-      score -= Heuristic.PIECE_VALUES[queen.kind]
-#    else:
-#      score += Heuristic.PIECE_VALUES[queen.kind]
-
-    queenAdjacentPieceCount = 0
-    queenAdjacentPoints = hive.getAdjacentPoints(queen.point)
-    for queenAdjacentPoint in queenAdjacentPoints:
+    if queen.isPlayed():
+      # pinned factor
+      if queen.isPinned(hive):
+        score -= Heuristic.PIECE_VALUES[queen.kind]
+#      else:
+#        score += Heuristic.PIECE_VALUES[queen.kind]
 
       # queen safety factor
-      if hive.getTopPieceAtPoint(queenAdjacentPoint):
-        queenAdjacentPieceCount += 1
+      queenAdjacentPieceCount = hive.getQueenAdjacentCount(queen.color)
+
+      queenAdjacentPoints = hive.getAdjacentPoints(queen.point)
+      for queenAdjacentPoint in queenAdjacentPoints:
 
-      # controlled gate factor
-      if hive.isPointInGate(queenAdjacentPoint):
-        # check to see if the gate is controlled (sides must be ours or pinned pieces)
-        for index, adjacentPoint in enumerate(hive.getAdjacentPoints(queenAdjacentPoint)):
-          if not hive.getTopPieceAtPoint(adjacentPoint): # empty adjacency from gate
-            easterPoint = hive.getAdjacentPoint(adjacentPoint, ((index - 1) % 6))
-            westerPoint = hive.getAdjacentPoint(adjacentPoint, ((index + 1) % 6))
-            easterPiece = hive.getTopPieceAtPoint(easterPoint)
-            westerPiece = hive.getTopPieceAtPoint(westerPoint)
-            if easterPiece and (easterPiece.color == queen.color or easterPiece.isPinned(hive)) and westerPiece and (westerPiece.color == queen.color or westerPiece.isPinned(hive)):
-              score += Heuristic.QUEEN_GATE_SCORE
-            break
+        # controlled gate factor
+        if hive.isPointInGate(queenAdjacentPoint):
+          # check to see if the gate is controlled (sides must be ours or pinned pieces)
+          for index, adjacentPoint in enumerate(hive.getAdjacentPoints(queenAdjacentPoint)):
+            if not hive.getTopPieceAtPoint(adjacentPoint): # empty adjacency from gate
+              easterPoint = hive.getAdjacentPoint(adjacentPoint, ((index - 1) % 6))
+              westerPoint = hive.getAdjacentPoint(adjacentPoint, ((index + 1) % 6))
+              easterPiece = hive.getTopPieceAtPoint(easterPoint)
+              westerPiece = hive.getTopPieceAtPoint(westerPoint)
+              if easterPiece and (easterPiece.color == queen.color or easterPiece.isPinned(hive)) and westerPiece and (westerPiece.color == queen.color or westerPiece.isPinned(hive)):
+                score += Heuristic.QUEEN_GATE_SCORE
+              break
 
-    score += Heuristic.QUEEN_SAFETY_SCORES[queenAdjacentPieceCount]
+      score += Heuristic.QUEEN_SAFETY_SCORES[queenAdjacentPieceCount]
 
 
     # Spider Evaluation...
@@ -465,7 +505,13 @@ class Drone():
   """ The bot that will play Hive """
   def __init__(self, args):
     self.args = self._parseArgs(args)
-    self.game = Game('' , '', self.args['times'], self.args['moves'], self.args['expansions'])
+    self.diskCache = None
+    self.transpositionRecords = None
+    if self.args['cache']:
+      self.diskCache = DiskCache(self.args['cache'])
+      (self.game, self.transpositionRecords) = Game.fromDiskCache(self.diskCache, 'drone', '' , '', self.args['times'], self.args['moves'], self.args['expansions'], self.args['trusted'])
+    else:
+      self.game = Game('' , '', self.args['times'], self.args['moves'], self.args['expansions'], self.args['trusted'])
     self.player = self.game.currentPlayer
     self.bestMove = None
 
@@ -475,24 +521,52 @@ class Drone():
     parser.add_argument(args[0], default='')
     parser.add_argument('--times', default='30000,0,0') # game time, white used, black used (ms)
     parser.add_argument('--moves', default='') # 1. wS1, 2. bG1 -wS1, 3. wQ wS1/, ...
+    parser.add_argument('--trusted', action='store_true') # the moves are known to be legal: replay them without validation
+    parser.add_argument('--persistent', action='store_true') # keep running for the whole game, reading BotProtocol commands from stdin
     parser.add_argument('--expansions', default='') # LM
+    parser.add_argument('--cache', default='') # directory to keep the position and transposition table in between turns
     args = parser.parse_args(args)
     return vars(args)
 
 
   def run(self):
+    if self.args['persistent']:
+      BotProtocol(self).run()
+    else:
+      self.findMove()
+      sys.stdout.write(self.getMoveString())
+
+
+  def findMove(self):
     self.bestMove = OpeningBook(self.game).findMove()
     if not self.bestMove:
-      self.bestMove = MoveSearch(self.game).findMove()
+      search = MoveSearch(self.game, self.transpositionRecords)
+      self.bestMove = search.findMove()
+      self.transpositionRecords = search.transpositionTable.getRecords() # the next search of a persistent game starts from them, not the whole table
+      if self.diskCache:
+        self.game.saveToDiskCache(self.diskCache, 'drone', self.transpositionRecords)
+    return self.bestMove
 
-    self.printMove()
 
+  def playMove(self, moveString):
+    """ BotProtocol play """
+    if self.args['trusted']:
+      self.game.playTrustedMove(moveString)
+    else:
+      self.game.playMove(moveString)
 
-  def printMove(self):
+
+  def go(self, timeControlsCsv):
+    """ BotProtocol go """
+    self.game.readTimeControls(timeControlsCsv)
+    self.findMove()
+    return self.getMoveString()
+
+
+  def getMoveString(self):
     if not self.bestMove:
-      sys.stdout.write('pass')
-    else:
-      sys.stdout.write(self.game.getMoveNotation(self.bestMove))
+      return 'pass'
+    return self.game.getMoveNotation(self.bestMove)
 
 
 
@@ -4,9 +4,11 @@ import os
 import shlex
 import subprocess
 import sys
+import threading
 from time import time
 from errors import *
 from game import *
+from protocol import *
 
 
 class Framework():
@@ -21,6 +23,10 @@ class Framework():
     parser.add_argument('--times', default='600000,0,0') # game time, white used, black used (ms)
     parser.add_argument('--moves', default='') # 1. wS1, 2. bG1 -wS1, 3. wQ wS1/, ...
     parser.add_argument('--expansions', default='') # LM
+    parser.add_argument('--output', default='board', choices=['board', 'record']) # board: the board after every move, record: a line per move
+    parser.add_argument('--trusted', action='store_true') # pass --trusted to the bots (they must accept it)
+    parser.add_argument('--cache', default='') # pass --cache to the bots: the directory they keep their state in between turns
+    parser.add_argument('--persistent', action='store_true') # start each bot once and talk BotProtocol to it (they must accept --persistent)
     args = parser.parse_args(args)
     args = vars(args)
     return args
@@ -29,18 +35,26 @@ class Framework():
     self.args['white'] = self.readBot('white', self.args['white'])
     self.args['black'] = self.readBot('black', self.args['black'])
     self.game = Game(self.args['white'], self.args['black'], self.args['times'], self.args['moves'], self.args['expansions'])
-    self.game.printBoard()
+    self.botProcesses = {}
+    isRecording = self.args['output'] == 'record'
+    if not isRecording:
+      self.game.printBoard()
 
     results = {}
     results['play_by_play'] = [] 
 
     error = ''
     while not self.game.isGameOver():
-      moveString, moveTime, errorOutput = self.readMove()
+      moveString, moveTime, errorOutput, cpuTime, peakMemory = self.readMove()
       if moveString == 'quit' or moveString == 'exit':
         break
+      if self.game.currentPlayer.bot and self.game.isOutOfTime():
+        sys.stderr.write(self.game.currentPlayer.color.capitalize() + ' ran out of time\n')
+        error = self.game.currentPlayer.color
+        break
       try:
-        sys.stdout.write(self.game.currentPlayer.color.capitalize() + ' plays ' + moveString + '\n')
+        if not isRecording:
+          sys.stdout.write(self.game.currentPlayer.color.capitalize() + ' plays ' + moveString + '\n')
         self.game.playMove(moveString)
       except InputError as e:
         sys.stderr.write(e.value + '\n')
@@ -53,22 +67,33 @@ class Framework():
           error = self.game.currentPlayer.color
           break;
       else:
-        sys.stdout.write('--times="'+self.game.getTimeControlsCsv()+'"\n')
-        sys.stdout.write('--moves="'+self.game.getMoveListCsv()+'"\n')
-        self.game.printBoard()
+        error = self.sendPlayedMove(moveString)
+        if error:
+          break
+        if isRecording:
+          sys.stdout.write('%d. %s %dms\n' % (self.game.turnNumber - 1, moveString, moveTime))
+        else:
+          sys.stdout.write('--times="'+self.game.getTimeControlsCsv()+'"\n')
+          sys.stdout.write('--moves="'+self.game.getMoveListCsv()+'"\n')
+          self.game.printBoard()
 
       results['play_by_play'].append({
         'move_number': self.game.turnNumber - 1,
         'move_string': moveString,
         'move_time': moveTime,
+        'cpu_time': cpuTime,
+        'peak_memory': peakMemory,
         'error_output': errorOutput,
       })
 
-    if error:
-      winner = Game.WINNER_WHITE if error == Player.BLACK else Game.WINNER_BLACK
-    else:
-      winner = self.game.getWinner()
+    for botProcess in self.botProcesses.itervalues():
+      botProcess.close()
 
+    if isRecording:
+      sys.stdout.write('--times="'+self.game.getTimeControlsCsv()+'"\n')
+      sys.stdout.write('--moves="'+self.game.getMoveListCsv()+'"\n')
+
+    winner = Framework.getWinner(self.game, error)
     if winner == Game.WINNER_WHITE:
       sys.stdout.write('White wins!\n')
     elif winner == Game.WINNER_BLACK:
@@ -76,53 +101,44 @@ class Framework():
     elif winner == Game.WINNER_DRAW:
       sys.stdout.write('It\'s a draw!\n')
 
-    results['args'] = {} 
-    results['args']['times'] = self.game.getTimeControlsCsv() 
-    results['args']['moves'] = self.game.getMoveListCsv() 
-    results['args']['expansions'] = self.args['expansions'] 
-    results['white'] = {} 
-    results['white']['wins'] = 1 if winner == Game.WINNER_WHITE else 0
-    results['white']['loses'] = 1 if winner == Game.WINNER_BLACK else 0
-    results['white']['draws'] = 1 if winner == Game.WINNER_DRAW else 0
-    results['white']['errors'] = 1 if error == Player.WHITE else 0
-    results['white']['number_of_moves'] = int(math.ceil(float(self.game.turnNumber - 1) / 2)) 
-    results['white']['time'] = self.game.whitePlayer.timeUsed
-    results['black'] = {} 
-    results['black']['wins'] = 1 if winner == Game.WINNER_BLACK else 0
-    results['black']['loses'] = 1 if winner == Game.WINNER_WHITE else 0
-    results['black']['draws'] = 1 if winner == Game.WINNER_DRAW else 0
-    results['black']['errors'] = 1 if error == Player.BLACK else 0
-    results['black']['number_of_moves'] = int(math.floor(float(self.game.turnNumber - 1) / 2)) 
-    results['black']['time'] = self.game.blackPlayer.timeUsed
-
-    return results
+    return Framework.getResults(self.game, self.args['expansions'], winner, error, results['play_by_play'])
 
   def norun(self):
     self.game = Game(self.args['white'], self.args['black'], self.args['times'], self.args['moves'], self.args['expansions'])
-    results = {}
-    results['play_by_play'] = [] 
+    return Framework.getResults(self.game, self.args['expansions'], Game.WINNER_DRAW, 0, [])
+
+
+  @staticmethod
+  def getWinner(game, error):
+    """ the color of a bot that made an error loses, else the game decides """
+    if error:
+      return Game.WINNER_WHITE if error == Player.BLACK else Game.WINNER_BLACK
+    return game.getWinner()
 
-    winner = Game.WINNER_DRAW
-    error = 0
 
+  @staticmethod
+  def getResults(game, expansions, winner, error, playByPlay):
+    """ the results of a game as run returns them (and the scheduler stores them) """
+    results = {}
+    results['play_by_play'] = playByPlay
     results['args'] = {} 
-    results['args']['times'] = self.game.getTimeControlsCsv() 
-    results['args']['moves'] = self.game.getMoveListCsv() 
-    results['args']['expansions'] = self.args['expansions'] 
+    results['args']['times'] = game.getTimeControlsCsv() 
+    results['args']['moves'] = game.getMoveListCsv() 
+    results['args']['expansions'] = expansions 
     results['white'] = {} 
     results['white']['wins'] = 1 if winner == Game.WINNER_WHITE else 0
     results['white']['loses'] = 1 if winner == Game.WINNER_BLACK else 0
     results['white']['draws'] = 1 if winner == Game.WINNER_DRAW else 0
     results['white']['errors'] = 1 if error == Player.WHITE else 0
-    results['white']['number_of_moves'] = int(math.ceil(float(self.game.turnNumber - 1) / 2)) 
-    results['white']['time'] = self.game.whitePlayer.timeUsed
+    results['white']['number_of_moves'] = int(math.ceil(float(game.turnNumber - 1) / 2)) 
+    results['white']['time'] = game.whitePlayer.timeUsed
     results['black'] = {} 
     results['black']['wins'] = 1 if winner == Game.WINNER_BLACK else 0
     results['black']['loses'] = 1 if winner == Game.WINNER_WHITE else 0
     results['black']['draws'] = 1 if winner == Game.WINNER_DRAW else 0
     results['black']['errors'] = 1 if error == Player.BLACK else 0
-    results['black']['number_of_moves'] = int(math.floor(float(self.game.turnNumber - 1) / 2)) 
-    results['black']['time'] = self.game.blackPlayer.timeUsed
+    results['black']['number_of_moves'] = int(math.floor(float(game.turnNumber - 1) / 2)) 
+    results['black']['time'] = game.blackPlayer.timeUsed
 
     return results
 
@@ -148,23 +164,35 @@ class Framework():
 
 
   def readMove(self): 
+    """
+      (move string, wall ms, stderr, cpu ms, peak memory KB) of the current player; a bot is killed when its clock runs out.
+      The cpu time and peak memory come from os.wait4 of a bot run for the move, they are None for humans,
+      persistent bots and where os.wait4 isn't available (Windows)
+    """
     moveString = 'error'
     moveTime = 0.0
     errorOutput = 0
+    cpuTime = None
+    peakMemory = None
 
     if self.game.currentPlayer.bot:
       try:
-        bot = self.game.currentPlayer.bot
-        if bot.endswith('.py'):
-          bot = 'python ' + bot
-
-        commandLine = bot + ' --times="' + self.game.getTimeControlsCsv() + '" --moves="' + self.game.getMoveListCsv() + '"'
-        args = shlex.split(commandLine)
-
-        startTime = time()
-        botProcess = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=None)
-        moveString, errorOutput = botProcess.communicate()
-        endTime = time()
+        if self.args['persistent']:
+          botProcess = self.getBotProcess()
+          clock = Framework.startClock(botProcess.process, self.game.getTimeLeft())
+          startTime = time()
+          moveString = botProcess.send(BotProtocol.GO, self.game.getTimeControlsCsv())
+          endTime = time()
+          clock.cancel()
+          errorOutput = botProcess.readErrorOutput()
+        else:
+          startTime = time()
+          botProcess = subprocess.Popen(shlex.split(Framework.getBotCommandLine(self.game, self.args['trusted'], self.args['cache'])), stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=None)
+          clock = Framework.startClock(botProcess, self.game.getTimeLeft())
+          moveString, errorOutput = Framework.readBotOutput(botProcess)
+          endTime = time()
+          clock.cancel()
+          cpuTime, peakMemory = Framework.waitForBot(botProcess)
 
         sys.stdout.write(errorOutput)
         moveTime = round((endTime - startTime) * 1000)
@@ -174,7 +202,92 @@ class Framework():
     else:
       moveString = raw_input(self.game.currentPlayer.color.capitalize() + "'s turn: ")
 
-    return (moveString, moveTime, errorOutput)
+    return (moveString, moveTime, errorOutput, cpuTime, peakMemory)
+
+
+  @staticmethod
+  def startClock(process, timeLeft):
+    """ a started Timer that kills the bot process once its time left (ms, None for no limit) is up, cancel it when the bot answers """
+    clock = threading.Timer(timeLeft / 1000.0 if timeLeft is not None else 0, Framework._killBot, [process])
+    clock.daemon = True
+    if timeLeft is not None:
+      clock.start()
+    return clock
+
+
+  @staticmethod
+  def _killBot(process):
+    try:
+      process.kill()
+    except OSError: # it has just exited
+      pass
+
+
+  @staticmethod
+  def readBotOutput(process):
+    """ (stdout, stderr) of the bot process up to its exit, like communicate but leaving the process to waitForBot """
+    errorOutput = []
+    errorReader = threading.Thread(target=lambda: errorOutput.append(process.stderr.read())) # so a full stderr pipe can't stall the bot
+    errorReader.daemon = True
+    errorReader.start()
+    output = process.stdout.read()
+    errorReader.join()
+    process.stdout.close()
+    process.stderr.close()
+    return (output, ''.join(errorOutput))
+
+
+  @staticmethod
+  def waitForBot(process, isPolled = False):
+    """
+      reaps the exited bot process: (cpu ms, peak memory KB) from its rusage, both None without os.wait4.
+      Polled, it returns None at once while the bot is still running.
+    """
+    if not hasattr(os, 'wait4'):
+      if isPolled and process.poll() is None:
+        return None
+      process.wait()
+      return (None, None)
+
+    (pid, status, usage) = os.wait4(process.pid, os.WNOHANG if isPolled else 0)
+    if not pid:
+      return None
+    process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    peakMemory = usage.ru_maxrss / 1024 if sys.platform == 'darwin' else usage.ru_maxrss # bytes on OS X, KB elsewhere
+    return (round((usage.ru_utime + usage.ru_stime) * 1000), peakMemory)
+
+
+  @staticmethod
+  def getBotCommandLine(game, isTrusted = False, cache = ''):
+    """ the current player's bot with the position so far """
+    bot = game.currentPlayer.bot
+    if bot.endswith('.py'):
+      bot = 'python ' + bot
+
+    commandLine = bot + ' --times="' + game.getTimeControlsCsv() + '" --moves="' + game.getMoveListCsv() + '"'
+    if isTrusted: # every move of the list went through Game.playMove, so the bot may skip validating them again
+      commandLine += ' --trusted'
+    if cache:
+      commandLine += ' --cache="' + cache + '"'
+    return commandLine
+
+
+  def getBotProcess(self):
+    """ the current player's BotProcess, started on its first turn (it is sent the moves played from then on) """
+    color = self.game.currentPlayer.color
+    if not color in self.botProcesses:
+      self.botProcesses[color] = BotProcess(Framework.getBotCommandLine(self.game, self.args['trusted'], self.args['cache']))
+    return self.botProcesses[color]
+
+
+  def sendPlayedMove(self, moveString):
+    """ tells the persistent bots about a move, the color of the first one that fails to take it (or '') """
+    for color, botProcess in self.botProcesses.iteritems():
+      reply = botProcess.send(BotProtocol.PLAY, moveString.strip())
+      if not reply == BotProtocol.OK:
+        sys.stderr.write(color + ' bot: ' + (reply or 'exited') + '\n')
+        return color
+    return ''
 
 
 if __name__ == "__main__": 
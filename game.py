@@ -1,24 +1,49 @@
 import re
 import sys
+from collections import namedtuple
 from errors import *
 from pieces import *
 from player import *
 from hive import *
+from cache import *
+
+# An immutable, picklable copy of a game's position (see Game.getSnapshot)
+#   cells: per piece id (see Piece.KEYS) the packed cell (cellId << 3) + z, or None while in the pile
+#   whiteStates, blackStates: the last hive states each player has seen, enough to detect a threefold repetition
+Snapshot = namedtuple('Snapshot', ['expansions', 'timeControls', 'turnNumber', 'cells', 'whiteStates', 'blackStates'])
+
 
 class Game:
   (WINNER_WHITE, WINNER_BLACK, WINNER_DRAW, WINNER_NONE) = (1, -1, 0, None)
+  SNAPSHOT_STATES = 4 # hive states kept per player, Player.hasSeenThreefoldRepetition looks back over them and the next one
+  MOVE_STAGES = ('QBG', 'SL', 'A', 'M') # the kinds generateValidMoves moves in turn, cheapest move generation first
+  MOVE_CACHE_SIZE = 1024 # move lists per generation of the LRUCache
+
+  # move notation, compiled once: '[color]kind[number]' and an optional ' [lm]relative piece[rm]' (see Hive.getRelativePoint)
+  MOVE_STRING_PATTERN = re.compile('^(?:pass)|(?:[bw]?[ABGLMQS][0-3]?(?:\\s[\\\/-]?[bw][ABGLMQS][0-3]?[\\\/-]?)?)$')
+  PIECE_PATTERN = re.compile('^(?P<color>b|w)?(?P<kind>[ABGLMQS])(?P<number>[0-3]?)')
+  RELATIVE_PATTERN = re.compile(' (?P<lm>[\\\/-]?)(?P<color>b|w)(?P<kind>[ABGLMQS])(?P<number>[0-3]?)(?P<rm>[\\\/-]?)$')
+  MOVE_NUMBER_PATTERN = re.compile('^[0-9]+. ')
+  TRUSTED_MOVE_PATTERN = re.compile('^[bw]?(?P<piece>[ABGLMQS][0-3]?)(?: (?P<lm>[\\\/-]?)(?P<relative>[bw][ABGLMQS][0-3]?)(?P<rm>[\\\/-]?))?$')
+
+  DISK_CACHE_REPLAY = 2 # moves a game loaded from a DiskCache may be behind its move list (a bot's own move and the reply)
 
-  def __init__(self, whiteBot, blackBot, timeControls, moveList, expansions):
+  # cell id offset from the relative piece's cell per relative position
+  RELATIVE_OFFSETS = dict(zip((Hive.NORTHEAST, Hive.EAST, Hive.SOUTHEAST, Hive.SOUTHWEST, Hive.WEST, Hive.NORTHWEST), Hive.ADJACENT_OFFSETS) + [(Hive.COVER, 0)])
+
+  def __init__(self, whiteBot, blackBot, timeControls, moveList, expansions, isTrusted = False):
+    self.expansions = expansions
     self.whitePlayer = Player(Player.WHITE, whiteBot, expansions)
     self.blackPlayer = Player(Player.BLACK, blackBot, expansions)
     self.currentPlayer = self.whitePlayer
     self.turnNumber = 1
-    self.hive = Hive(expansions)
+    self.hive = Hive()
+    self.moveCache = LRUCache(Game.MOVE_CACHE_SIZE) # (zobrist state, cell total, queen bee must be placed) -> (kind, start cell or None, end point) tuples
 
     self.gameTime = 300000 #ms
-    self._readTimeControls(timeControls)
+    self.readTimeControls(timeControls)
     self.moveList = []
-    self._readMoveList(moveList)
+    self._readMoveList(moveList, isTrusted)
     self.winner = None
 
   def getCurrentPlayer(self):
@@ -31,8 +56,9 @@ class Game:
   def playMove(self, moveString):
     self.validateMoveString(moveString)
 
-    if moveString == 'pass' and not len(self.getValidMoves()) == 0:
-      raise MoveError("You cannot pass when you have legal moves.")
+    if moveString == 'pass':
+      if self.hasValidMove():
+        raise MoveError("You cannot pass when you have legal moves.")
     else:
       # check if the piece hasn't been played yet, otherwise take if from the board
       pieceAttributes = self.parsePieceAttributes(moveString, self.currentPlayer.color)
@@ -59,9 +85,8 @@ class Game:
         relativePosition = relativeAttributes[1]
       proposedPoint = self.hive.getRelativePoint(piece, relativePiece, relativePosition)
 
-      # check if valid move
-      possiblePoints = piece.getPossiblePoints(self.hive)
-      if not self.isValidMove(proposedPoint, possiblePoints):
+      # check if valid move (only for this piece and cell, see isLegalMove)
+      if not self.isLegalMove(Move(piece, piece.point, proposedPoint)):
         raise MoveError ("The move you entered is not valid.")
 
       # make the move
@@ -69,6 +94,31 @@ class Game:
         self.hive.pickupPiece(piece)
       self.hive.putdownPiece(piece, proposedPoint)
 
+    self._endTurn(moveString)
+
+
+  def playTrustedMove(self, moveString):
+    """
+      Makes a move known to be legal (e.g. from a history the framework has validated), only decoding the notation:
+      no validation, rule checks or move generation, so replaying a game costs next to nothing per move.
+    """
+    if not moveString == 'pass':
+      matches = Game.TRUSTED_MOVE_PATTERN.match(moveString)
+      piece = self.currentPlayer.pieces[matches.group('piece')]
+      cellId = 0 # the first piece goes to the origin
+      if matches.group('relative'):
+        relativePiece = self.hive.playedPieces[matches.group('relative')]
+        relativePosition = (matches.group('lm') or ' ') + (matches.group('rm') or ' ')
+        cellId = self.hive.getCellId(relativePiece.point) + Game.RELATIVE_OFFSETS[relativePosition]
+
+      if piece.isPlayed():
+        self.hive.pickupPiece(piece)
+      self.hive.putdownPiece(piece, self.hive.getCellPoint(cellId))
+
+    self._endTurn(moveString)
+
+
+  def _endTurn(self, moveString):
     self.moveList.append(str(self.turnNumber) + '. ' + moveString)
     self.turnNumber += 1
     self.switchCurrentPlayer()
@@ -97,41 +147,131 @@ class Game:
     return Game.WINNER_NONE
     
 
-  def isValidMove(self, proposedPoint, possiblePoints):
-    for point in possiblePoints:
-      if point.x == proposedPoint.x and point.y == proposedPoint.y and point.z == proposedPoint.z:
-        return True
-    return False
-
-
   def getValidMoves(self):
-    moveList = []
+    """
+      every legal move of the side to move, a new list. A position whose moves were listed before is answered from moveCache.
+      generateValidMoves doesn't cache: a search seldom generates a position's moves twice, its transposition table sees to that
+    """
+    cacheKey = self._getMoveCacheKey()
+    cachedMoves = self.moveCache.get(cacheKey)
+    if cachedMoves is not None:
+      return self._getCachedMoves(cachedMoves)
+
+    validMoves = list(self.generateValidMoves())
+    self.moveCache.put(cacheKey, [self._getCacheMove(move) for move in validMoves])
+    return validMoves
+
+
+  def generateValidMoves(self, firstMove = None):
+    """
+      The moves of getValidMoves generated lazily from cheap to expensive, so a search that cuts off early never walks the ants:
+      firstMove (when it is legal), the placements, then the moves of the pieces on the board one MOVE_STAGES entry at a time.
+      The position must be the same whenever the generator resumes (unmake each move before asking for the next).
+    """
+    hive = self.hive
+    player = self.currentPlayer
+    (firstPiece, firstCell) = (None, None)
+    if firstMove and self.isLegalMove(firstMove):
+      (firstPiece, firstCell) = (firstMove.piece, hive.getCellId(firstMove.endPoint))
+      yield firstMove
+
+    for piece in self.getPlacementPieces():
+      for cellId in list(hive.getEntryCells(piece.color)):
+        if not (piece is firstPiece and cellId == firstCell):
+          yield Move(piece, piece.point, hive.getCellPoint(cellId))
 
-    if (self.turnNumber + 1) / 2 == 4 and not self.currentPlayer.hasPlayed('Q'):
+    # may not move a piece until queen is moved
+    if not player.hasPlayed('Q'):
+      return
+
+    board = hive.board
+    pinnedCells = hive.getPinnedCells()
+    playedPieces = [piece for piece in player.pieces.itervalues() if piece.isPlayed()]
+    for kinds in Game.MOVE_STAGES:
+      for piece in playedPieces:
+        if not piece.kind in kinds:
+          continue
+        cellId = hive.getCellId(piece.point)
+        if board[cellId][-1] is piece and not cellId in pinnedCells:
+          for endCell in piece.getMoveCells(hive):
+            if not (piece is firstPiece and endCell == firstCell):
+              yield Move(piece, piece.point, hive.getCellPoint(endCell))
+
+
+  def _getCacheMove(self, move):
+    """
+      the move as moveCache keeps it, without the piece: the Zobrist state doesn't tell apart pieces of a kind,
+      so the same state may be reached with, say, wA1 and wA2 on each other's cells. The end point is the same in every such position.
+    """
+    if move.piece.isPlayed():
+      return (move.piece.kind, self.hive.getCellId(move.startPoint), move.endPoint)
+    return (move.piece.kind, None, move.endPoint)
+
+
+  def _getCachedMoves(self, cachedMoves):
+    """ the Moves of moveCache tuples in this position: the top piece of the start cell, or the piece getPlacementPieces places """
+    board = self.hive.board
+    placementPieces = dict([(piece.kind, piece) for piece in self.getPlacementPieces()])
+    moves = []
+    for (kind, startCell, endPoint) in cachedMoves:
+      piece = board[startCell][-1] if startCell is not None else placementPieces[kind]
+      moves.append(Move(piece, piece.point, endPoint))
+    return moves
+
+
+  def _getMoveCacheKey(self):
+    """ the position with the side to move (both in the Zobrist state), and whether the queen bee must be placed this turn """
+    return (self.hive.getState(), self.hive.cellTotal, (self.turnNumber + 1) / 2 == 4 and not self.currentPlayer.hasPlayed('Q'))
+
+
+  def getPlacementPieces(self):
+    """ the pieces of the current player's pile that may be placed: one of each kind, or only the queen bee when it must be played """
+    player = self.currentPlayer
+    if (self.turnNumber + 1) / 2 == 4 and not player.hasPlayed('Q'):
       # queen must be played in a player's first 4 moves
-      queenBee = self.currentPlayer.pieces['Q']
-      for point in queenBee.getPossiblePoints(self.hive):
-        moveList.append(Move(queenBee, queenBee.point, point))
-      return moveList
+      return [player.pieces['Q']]
+
+    placementPieces = []
+    placedKinds = set() # only important to be able one of each piece kind
+    for piece in player.pieces.itervalues():
+      if not piece.isPlayed() and not piece.kind in placedKinds:
+        placedKinds.add(piece.kind)
+        placementPieces.append(piece)
+    return placementPieces
+
+
+  def isLegalMove(self, move):
+    """ whether the current player may make the move, asking the piece about the end cell alone (see Piece.canReachCell) """
+    piece = move.piece
+    if not move.startPoint == piece.point or not self._isMovable(piece):
+      return False
+    cellId = self.hive.getCellId(move.endPoint)
+    if not piece.isPlayed():
+      return cellId in self.hive.getEntryCells(piece.color)
+    return piece.canReachCell(self.hive, cellId)
+
+
+  def hasValidMove(self):
+    """ whether the side to move has a legal move (and so may not pass), stopping at the first one found """
+    for move in self.generateValidMoves():
+      return True
+    return False
 
-    # may not move a piece until queen is moved
-    canMoveHivePieces = True
-    if not self.currentPlayer.hasPlayed('Q'):
-      canMoveHivePieces = False
 
-    # only important to be able one of each piece kind
-    entryMovesAdded = {'A': False, 'B': False, 'G': False, 'Q': False, 'S': False, 'M': False, 'L': False, 'D': False}
+  def _isMovable(self, piece):
+    """ whether the rules let the current player place or move the piece at all, wherever it goes """
+    player = self.currentPlayer
+    if not piece.color == player.color[0]:
+      return False
 
-    for key, piece in self.currentPlayer.pieces.iteritems():
-      if piece.isPlayed() and canMoveHivePieces:
-        for point in piece.getPossiblePoints(self.hive):
-          moveList.append(Move(piece, piece.point, point))
-      if not piece.isPlayed() and not entryMovesAdded[piece.kind]:
-        entryMovesAdded[piece.kind] = True
-        for point in piece.getPossiblePoints(self.hive):
-          moveList.append(Move(piece, piece.point, point))
+    if not piece.isPlayed():
+      # queen must be played in a player's first 4 moves
+      return not ((self.turnNumber + 1) / 2 == 4 and not player.hasPlayed('Q') and not piece.kind == 'Q')
 
-    return moveList
+    # may not move a piece until queen is moved
+    if not player.hasPlayed('Q'):
+      return False
+    return self.hive.getTopPieceAtPoint(piece.point) is piece and not self.hive.isBrokenWithoutPiece(piece)
 
 
   def makeMove(self, move):
@@ -153,11 +293,76 @@ class Game:
       self.hive.putdownPiece(move.piece, move.startPoint)
 
     #self.moveList.pop()
-    self.turnNumber += 1
+    self.currentPlayer.removeHiveState() # the state makeMove added for the player it switched to
+    self.turnNumber -= 1
     self.switchCurrentPlayer()
-    self.currentPlayer.removeHiveState()
     
 
+  def getSnapshot(self):
+    """ The position as a Snapshot (the move list is not kept) """
+    cells = [None] * (len(Piece.COLORSTRING) * len(Piece.KEYS))
+    for piece in self.hive.playedPieces.itervalues():
+      cells[piece.id] = (self.hive.getCellId(piece.point) << 3) + piece.point.z
+    return Snapshot(self.expansions, self.getTimeControlsCsv(), self.turnNumber, tuple(cells),
+      tuple(self.whitePlayer.seenHiveStates[-Game.SNAPSHOT_STATES:]), tuple(self.blackPlayer.seenHiveStates[-Game.SNAPSHOT_STATES:]))
+
+
+  @staticmethod
+  def fromSnapshot(snapshot, whiteBot = '', blackBot = ''):
+    """ A new Game in the position of a Snapshot, with the pieces put down straight onto their cells """
+    game = Game(whiteBot, blackBot, snapshot.timeControls, '', snapshot.expansions)
+    pieces = dict([(piece.id, piece) for player in (game.whitePlayer, game.blackPlayer) for piece in player.pieces.itervalues()])
+    placed = sorted([(packedCell & 7, pieceId, packedCell >> 3) for pieceId, packedCell in enumerate(snapshot.cells) if packedCell is not None])
+    game.hive.putdownPieces([(pieces[pieceId], game.hive.getCellPoint(cellId)) for z, pieceId, cellId in placed])
+
+    game.turnNumber = snapshot.turnNumber
+    if snapshot.turnNumber % 2 == 0:
+      game.switchCurrentPlayer()
+    game.whitePlayer.seenHiveStates = list(snapshot.whiteStates)
+    game.blackPlayer.seenHiveStates = list(snapshot.blackStates)
+    return game
+
+
+  def saveToDiskCache(self, diskCache, botName, searchRecords = None):
+    """
+      saves the Snapshot of the position under the move list so far, along with anything a search wants to resume with;
+      the entry is the bot's own (botName playing the side to move), so bots sharing a directory don't resume from each other's searches
+    """
+    moves = [Game.MOVE_NUMBER_PATTERN.sub('', move) for move in self.moveList]
+    diskCache.save(Game._getDiskCacheKey(self.expansions, botName, moves), (self.getSnapshot(), searchRecords))
+
+
+  @staticmethod
+  def fromDiskCache(diskCache, botName, whiteBot, blackBot, timeControls, moveListCsv, expansions, isTrusted = False):
+    """
+      Game(...) resumed from the snapshot botName saved for the longest prefix of the move list with the same side to move
+      (at most DISK_CACHE_REPLAY moves short), playing only the moves after it.
+      Returns (the game, the search records saved with the snapshot or None when rebuilt from scratch).
+    """
+    moves = Game._splitMoveList(moveListCsv)
+    for length in range(len(moves), max(len(moves) - Game.DISK_CACHE_REPLAY, 1) - 1, -2):
+      entry = diskCache.load(Game._getDiskCacheKey(expansions, botName, moves[:length]))
+      if entry:
+        (snapshot, searchRecords) = entry
+        game = Game.fromSnapshot(snapshot, whiteBot, blackBot)
+        game.readTimeControls(timeControls)
+        game.moveList = [str(number + 1) + '. ' + move for number, move in enumerate(moves[:length])]
+        for move in moves[length:]:
+          if isTrusted:
+            game.playTrustedMove(move)
+          else:
+            game.playMove(move)
+        return (game, searchRecords)
+
+    return (Game(whiteBot, blackBot, timeControls, moveListCsv, expansions, isTrusted), None)
+
+
+  @staticmethod
+  def _getDiskCacheKey(expansions, botName, moves):
+    """ the color is that of the side to move after the moves, the bot's own """
+    return expansions + ':' + botName + ':' + 'wb'[len(moves) % 2] + ':' + ', '.join(moves)
+
+
   def getMoveNotation(self, move):
     moveString = move.piece.getNotation()
 
@@ -196,13 +401,13 @@ class Game:
 
   def validateMoveString(self, moveString):
     """ Basic input string validation (note: this is incomplete doesn't validate invalid stuff like wB3 -bQ2) """
-    match = re.match('^(?:pass)|(?:[bw]?[ABGLMQS][0-3]?(?:\\s[\\\/-]?[bw][ABGLMQS][0-3]?[\\\/-]?)?)$', moveString)
+    match = Game.MOVE_STRING_PATTERN.match(moveString)
     if not match:
       raise InputError("The move you entered is not valid.")
 
 
   def parsePieceAttributes(self, moveString, currentColor):
-    matches = re.search('^(?P<color>b|w)?(?P<kind>[ABGLMQS])(?P<number>[0-3]?)', moveString)
+    matches = Game.PIECE_PATTERN.search(moveString)
     color = matches.group('color')
     if not color:
       color = currentColor
@@ -210,7 +415,7 @@ class Game:
 
 
   def parseRelativeAttributes(self, moveString):
-    matches = re.search(' (?P<lm>[\\\/-]?)(?P<color>b|w)(?P<kind>[ABGLMQS])(?P<number>[0-3]?)(?P<rm>[\\\/-]?)$', moveString)
+    matches = Game.RELATIVE_PATTERN.search(moveString)
     if matches:
       position = (matches.group('lm') if matches.group('lm') != '' else ' ') + (matches.group('rm') if matches.group('rm') != '' else ' ')
       return ((matches.group('color'), matches.group('kind'), matches.group('number')), position)
@@ -225,19 +430,24 @@ class Game:
     self.hive.zobrist.changeSide()
 
 
-  def _readMoveList(self, moveListCsv):
-    moveList = moveListCsv.split(', ')
-    for move in moveList:
-      if not move == '':
-        move = re.sub('^[0-9]+. ', '', move)
-        self.playMove(move)
+  def _readMoveList(self, moveListCsv, isTrusted = False):
+    """ plays the moves of a --moves list, validating each unless the list is trusted (see playTrustedMove) """
+    playMove = self.playTrustedMove if isTrusted else self.playMove
+    for move in Game._splitMoveList(moveListCsv):
+      playMove(move)
+
+
+  @staticmethod
+  def _splitMoveList(moveListCsv):
+    """ the move strings of a --moves list, without their numbers """
+    return [Game.MOVE_NUMBER_PATTERN.sub('', move) for move in moveListCsv.split(', ') if not move == '']
 
 
   def getMoveListCsv(self):
     return ', '.join(map(str, self.moveList)) + ', '
 
 
-  def _readTimeControls(self, timeControlsCsv):
+  def readTimeControls(self, timeControlsCsv):
     timeControls = timeControlsCsv.split(',')
     self.gameTime = float(timeControls[0])
     self.whitePlayer.timeUsed = float(timeControls[1])
@@ -246,6 +456,18 @@ class Game:
 
   def getTimeControlsCsv(self):
     return str(self.gameTime) + ',' + str(self.whitePlayer.timeUsed) + ',' + str(self.blackPlayer.timeUsed)
+
+
+  def getTimeLeft(self):
+    """ ms left on the current player's clock, None when the game isn't timed (a game time of 0) """
+    if self.gameTime <= 0:
+      return None
+    return max(0.0, self.gameTime - self.currentPlayer.timeUsed)
+
+
+  def isOutOfTime(self):
+    """ the current player has used up the game time """
+    return self.gameTime > 0 and self.currentPlayer.timeUsed >= self.gameTime
    
 
   def printBoard(self):
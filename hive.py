@@ -1,7 +1,8 @@
-import math
 import sys
 from pieces import *
 from zobrist import *
+from planes import *
+from cache import *
 from collections import namedtuple
 
 class Move(namedtuple('Move', ['piece', 'startPoint', 'endPoint'])):
@@ -9,6 +10,34 @@ class Move(namedtuple('Move', ['piece', 'startPoint', 'endPoint'])):
 
 
 
+def _hasTwoEmptyAdjacent(adjacentMask):
+  """ two empty adjacent points in a row, walking the adjacencies from NORTHEAST to NORTHWEST """
+  freeCount = 0
+  for index in range(6):
+    freeCount = 0 if adjacentMask & (1 << index) else freeCount + 1
+    if freeCount > 1:
+      return True
+  return False
+
+
+def _isOneArc(adjacentMask):
+  """ the occupied adjacent points are one unbroken run around the hex (going round from NORTHWEST back to NORTHEAST) """
+  runStarts = [index for index in range(6) if adjacentMask & (1 << index) and not adjacentMask & (1 << ((index - 1) % 6))]
+  return len(runStarts) == 1 or adjacentMask == 63
+
+
+def _getSlideIndices(adjacentMask):
+  """ adjacent indices an empty hex can slide to: the target is empty and exactly one of the two flanks is occupied """
+  indices = []
+  for index in range(6):
+    isEasterOccupied = adjacentMask & (1 << ((index - 1) % 6))
+    isWesterOccupied = adjacentMask & (1 << ((index + 1) % 6))
+    if not adjacentMask & (1 << index) and bool(isEasterOccupied) != bool(isWesterOccupied):
+      indices.append(index)
+  return indices
+
+
+
 class Hive:
   """ The Hive "board"
           x-axis     
@@ -38,11 +67,12 @@ class Hive:
       (x, y-1) NORTHWEST
       Also connects to pieces at (x,y,z-1) COVERING and (x,y,z+1) COVERED
      
-    Since the board expands ad infinitum, we will use a dictionary with keys "x,y". Where each entry is a list of pieces at the hex.
+    Since the board expands ad infinitum, we will use a dictionary keyed by a packed integer cell id. Where each entry is a list of pieces at the hex.
+    The cell id packs x into the high bits and y into the low CELL_SHIFT bits: cellId = (x << CELL_SHIFT) + y
     e.g.:
-      board["0,0"] = [wQ]
-      board["-1,0"] = [bQ, wB1]   -- the white beetle is on top of of the black queen bee
-      board["-1,-1] = [bG1]
+      board[getCellId(Point(0,0,0))] = [wQ]
+      board[getCellId(Point(-1,0,0))] = [bQ, wB1]   -- the white beetle is on top of of the black queen bee
+      board[getCellId(Point(-1,-1,0))] = [bG1]
 
 
     hexspace -> array given by:
@@ -67,29 +97,73 @@ class Hive:
   ADJACENT_WEST = 4
   ADJACENT_NORTHWEST = 5
 
-  def __init__(self, expansions):
+  # cell id offsets of the adjacent cells (same order as the adjacent point indices)
+  ADJACENT_OFFSETS = ((1 << CELL_SHIFT), (1 << CELL_SHIFT) + 1, 1, -(1 << CELL_SHIFT), -(1 << CELL_SHIFT) - 1, -1)
+
+  # (adjacent offset, easter flank offset, wester flank offset) per adjacent index
+  # the flanks are the two cells adjacent to both ends of a step, a slide between two occupied flanks is a gate
+  ADJACENT_FLANKS = tuple([(ADJACENT_OFFSETS[index], ADJACENT_OFFSETS[(index - 1) % 6], ADJACENT_OFFSETS[(index + 1) % 6]) for index in range(6)])
+
+  ANALYSIS_CACHE_SIZE = 8192 # analyses per generation of the LRUCache
+
+  # lookup tables indexed by a six bit adjacency mask (bit i set when the adjacent point with index i is occupied)
+  SURROUNDED_MASK = 63
+  ADJACENT_COUNTS = [bin(adjacentMask).count('1') for adjacentMask in range(64)]
+  HAS_TWO_EMPTY_ADJACENT = [_hasTwoEmptyAdjacent(adjacentMask) for adjacentMask in range(64)]
+  IS_ONE_ARC = [_isOneArc(adjacentMask) for adjacentMask in range(64)]
+
+  # edges of the perimeter graph: cell id offsets of the legal slides out of an empty hex
+  SLIDE_OFFSETS = [tuple([ADJACENT_OFFSETS[index] for index in _getSlideIndices(adjacentMask)]) for adjacentMask in range(64)]
+
+  def __init__(self):
     self.board = dict()
-    self.zobrist = Zobrist(5 + len(expansions))
+    self.zobrist = Zobrist()
     self.numberOfPieces = 0
+    self.cellTotal = 0 # sum of the cell ids of the pieces, tells apart positions the Zobrist window wraps onto each other
+    self.analysisCache = LRUCache(Hive.ANALYSIS_CACHE_SIZE) # (zobrist state, cell total, analysis name) -> result
+    self.adjacentColorCounts = {'w': dict(), 'b': dict()} # cell -> number of adjacent top pieces of the color
+    self.entryCells = {'w': set(), 'b': set()}
+    self.adjacentMasks = dict() # cell -> six bit mask of the occupied adjacent cells
+    self.perimeterCells = set() # empty cells adjacent to the hive
+    self.playedPieces = dict() # notation -> piece, for the pieces on the board
+    self.queenCells = dict() # color -> cell of that color's queen bee (while on the board)
+    self.planes = None # BoardPlanes once enablePlanes is called
+    self.columnCounts = dict() # array x (see getBoardArrayLimits) -> number of occupied cells in that column
+    self.rowCounts = dict() # array y -> number of occupied cells in that row
+
+
+  def enablePlanes(self):
+    """ keeps an array mirror of the board from now on (see BoardPlanes, which needs NumPy) and returns it """
+    if not self.planes:
+      self.planes = BoardPlanes(self)
+    return self.planes
 
 
-  def getBoardKey(self, point):
-    return `point.x` + ',' + `point.y`
+  def getCellId(self, point):
+    return (point.x << CELL_SHIFT) + point.y
+
+
+  def getCellPoint(self, cellId, z = 0):
+    x = (cellId + CELL_HALF) >> CELL_SHIFT
+    return Point(x, cellId - (x << CELL_SHIFT), z)
 
 
   def getTopPieceAtPoint(self, point):
-    key = self.getBoardKey(point)
-    if self.board.has_key(key):
-      pieces = self.board[key]
+    pieces = self.board.get((point.x << CELL_SHIFT) + point.y)
+    if pieces:
+      return pieces[-1]
+    return None
+
+
+  def getTopPieceAtCell(self, cellId):
+    pieces = self.board.get(cellId)
+    if pieces:
       return pieces[-1]
     return None
 
 
   def getPiecesAtPoint(self, point):
-    key = self.getBoardKey(point)
-    if self.board.has_key(key):
-      return self.board[key]
-    return []
+    return self.board.get(self.getCellId(point), [])
 
 
   def getState(self):
@@ -154,98 +228,362 @@ class Hive:
     return (abs(dx) + abs(dy) + abs(dx-dy)) / 2
 
 
+  def getHeight(self, cellId):
+    return len(self.board.get(cellId, ()))
+
+
+  def getAdjacentMask(self, cellId):
+    return self.adjacentMasks.get(cellId, 0)
+
+
+  def getAdjacentCount(self, cellId):
+    return Hive.ADJACENT_COUNTS[self.adjacentMasks.get(cellId, 0)]
+
+
   def doesPointBorderOnlyColor(self, point, color):
-    for point in self.getAdjacentPoints(point):
-      piece = self.getTopPieceAtPoint(point)
-      if piece and not piece.color == color:
-        return False
-    return True
+    otherColor = 'b' if color == 'w' else 'w'
+    return not self.adjacentColorCounts[otherColor].get(self.getCellId(point))
 
 
   def isPointInGate(self, point):
     """ point must be bordered on 5+ sides """
-    borderCount = 0
-    for point in self.getAdjacentPoints(point):
-      piece = self.getTopPieceAtPoint(point)
-      if piece:
-        borderCount += 1
-
-    return borderCount >= 5
+    return self.getAdjacentCount(self.getCellId(point)) >= 5
 
 
   def hasTwoEmptyAdjacentPoints(self, point):
-    freeCount = 0
-    maxFreeCount = 0
-    adjacentPoints = self.getAdjacentPoints(point)
-    for adjacentPoint in adjacentPoints:
-      if self.getTopPieceAtPoint(adjacentPoint):
-        freeCount = 0 # reset free count
-      else:
-        freeCount += 1
-      maxFreeCount = max(maxFreeCount, freeCount)
-
-    return maxFreeCount > 1
+    return Hive.HAS_TWO_EMPTY_ADJACENT[self.adjacentMasks.get(self.getCellId(point), 0)]
 
 
   def getEntryPoints(self, color):
+    return [self.getCellPoint(cellId) for cellId in self.getEntryCells(color)]
+
+
+  def getEntryCells(self, color):
+    """ The empty cells where a new piece of color may be placed (kept up to date by pickupPiece/putdownPiece) """
     if self.numberOfPieces == 0:
-      return [Point(0, 0, 0)]
+      return set([0])
     if self.numberOfPieces == 1:
-      return self.getAdjacentPoints(Point(0, 0, 0))
-
-    points = []
-    uniquePoints = dict()
+      return set(Hive.ADJACENT_OFFSETS)
+    return self.entryCells[color]
+
+
+  def _updateTopPiece(self, cellId, oldTopPiece, newTopPiece):
+    """ Update the adjacent color counts and entry cells around cellId after its top piece changed """
+    oldColor = oldTopPiece.color if oldTopPiece else None
+    newColor = newTopPiece.color if newTopPiece else None
+    if oldColor == newColor:
+      return
+
+    for offset in Hive.ADJACENT_OFFSETS:
+      adjacentCell = cellId + offset
+      if oldColor:
+        counts = self.adjacentColorCounts[oldColor]
+        count = counts[adjacentCell] - 1
+        if count:
+          counts[adjacentCell] = count
+        else:
+          del counts[adjacentCell]
+      if newColor:
+        counts = self.adjacentColorCounts[newColor]
+        counts[adjacentCell] = counts.get(adjacentCell, 0) + 1
+      self._updateEntryCell(adjacentCell)
+
+    self._updateEntryCell(cellId)
+
+
+  def _updateAdjacentMasks(self, cellId, isOccupied):
+    """ 
+      cellId was just occupied or emptied: flip its bit in the adjacency mask of each adjacent cell
+      and keep the perimeter (the nodes of the slide graph) in step
+    """
+    adjacentMasks = self.adjacentMasks
+    perimeterCells = self.perimeterCells
+    for index, offset in enumerate(Hive.ADJACENT_OFFSETS):
+      adjacentCell = cellId + offset
+      bit = 1 << ((index + 3) % 6) # the adjacent cell sees cellId from the opposite direction
+      if isOccupied:
+        adjacentMasks[adjacentCell] = adjacentMasks.get(adjacentCell, 0) | bit
+        if not adjacentCell in self.board:
+          perimeterCells.add(adjacentCell)
+      else:
+        adjacentMask = adjacentMasks[adjacentCell] & ~bit
+        if adjacentMask:
+          adjacentMasks[adjacentCell] = adjacentMask
+        else:
+          del adjacentMasks[adjacentCell]
+          perimeterCells.discard(adjacentCell)
+
+    if isOccupied:
+      perimeterCells.discard(cellId)
+    elif cellId in adjacentMasks:
+      perimeterCells.add(cellId)
+
+
+  def getPerimeterCells(self):
+    """ the nodes of the perimeter graph: every empty hex adjacent to the hive """
+    return self.perimeterCells
+
+
+  def getSlideCells(self, cellId):
+    """ the perimeter graph edges out of the empty hex cellId """
+    return [cellId + offset for offset in Hive.SLIDE_OFFSETS[self.adjacentMasks.get(cellId, 0)]]
+
+
+  def getPerimeterComponents(self):
+    """ cell -> the connected component (frozenset of cells) of the perimeter graph holding it, cached per Zobrist state """
+    return self._getAnalysis('perimeterComponents', self._findPerimeterComponents)
+
+
+  def _findPerimeterComponents(self):
+    components = dict()
+    for startCell in self.perimeterCells:
+      if not startCell in components:
+        component = frozenset(self.traversePerimeter(startCell))
+        for cellId in component:
+          components[cellId] = component
+    return components
+
+
+  def getSlideReachableCells(self, cellId):
+    """
+      The hexes the only piece at cellId can reach by sliding around the hive (an ant move), not including cellId.
+
+      Lifting the piece only changes the slides between cellId and its adjacent hexes, so every slider shares the 
+      perimeter components of the position and corrects them locally: the components joined to cellId through the
+      changed slides are reachable in full, less the hexes that lose contact with the hive.
+      A component that loses a slide could split, if it is not clearly joined to cellId the perimeter is walked instead.
+    """
+    adjacentMasks = self.adjacentMasks
+    slideOffsets = Hive.SLIDE_OFFSETS
+    components = self.getPerimeterComponents()
+
+    liftedMasks = self.getLiftedMasks(cellId)
+
+    lostCells = set()
+    brokenComponents = set() # components losing a slide
+    for adjacentCell, liftedMask in liftedMasks.iteritems():
+      if not liftedMask:
+        lostCells.add(adjacentCell)
+      for offset in slideOffsets[adjacentMasks[adjacentCell]]:
+        if not offset in slideOffsets[liftedMask]:
+          brokenComponents.add(components[adjacentCell])
+          break
+
+    # walk the changed slides around cellId, an intact component links all of its adjacent hexes
+    liftedMasks[cellId] = adjacentMasks.get(cellId, 0)
+    reachedCells = set([cellId])
+    frontier = [cellId]
+    while frontier:
+      localCell = frontier.pop()
+      nextCells = [localCell + offset for offset in slideOffsets[liftedMasks[localCell]]]
+      if not localCell == cellId and not components[localCell] in brokenComponents:
+        nextCells.extend(adjacentCell for adjacentCell in liftedMasks if components.get(adjacentCell) is components[localCell])
+      for nextCell in nextCells:
+        if nextCell in liftedMasks and not nextCell in reachedCells:
+          reachedCells.add(nextCell)
+          frontier.append(nextCell)
+
+    reachableCells = set()
+    for adjacentCell in liftedMasks:
+      if adjacentCell == cellId or adjacentCell in lostCells:
+        continue
+      component = components[adjacentCell]
+      if component in brokenComponents:
+        # a broken component is only safe if every one of its pieces (which all touch cellId) was reached
+        isReached = [localCell in reachedCells for localCell in liftedMasks if components.get(localCell) is component and not localCell in lostCells]
+        if any(isReached) and not all(isReached):
+          reachableCells = self.traversePerimeter(cellId, liftedMasks)
+          reachableCells.remove(cellId)
+          return reachableCells
+      if adjacentCell in reachedCells:
+        reachableCells.update(component)
+
+    reachableCells.difference_update(lostCells)
+    return reachableCells
+
+
+  def getLiftedMasks(self, cellId):
+    """ empty cell adjacent to cellId -> its adjacency mask once the only piece at cellId is lifted """
+    liftedMasks = dict()
+    for index, offset in enumerate(Hive.ADJACENT_OFFSETS):
+      adjacentCell = cellId + offset
+      if not adjacentCell in self.board:
+        liftedMasks[adjacentCell] = self.adjacentMasks[adjacentCell] & ~(1 << ((index + 3) % 6))
+    return liftedMasks
+
+
+  def isSlideReachable(self, cellId, targetCell):
+    """
+      Whether the only piece at cellId can slide around the hive to targetCell (is targetCell in getSlideReachableCells),
+      answered by a walk of the perimeter graph with the piece lifted that stops as soon as it gets there.
+    """
+    if not targetCell in self.perimeterCells:
+      return False
+    liftedMasks = self.getLiftedMasks(cellId)
+    if liftedMasks.get(targetCell) == 0: # loses contact with the hive
+      return False
 
-    for key, pieces in self.board.iteritems():
-      piece = pieces[-1] 
-      if piece.color == color:
-        for adjacentPoint in self.getAdjacentPoints(piece.point):
-          adjacentKey = self.getBoardKey(adjacentPoint)
-          if not self.board.has_key(adjacentKey) and not uniquePoints.has_key(adjacentKey):
-            if self.numberOfPieces == 1 or self.doesPointBorderOnlyColor(adjacentPoint, color):
-              uniquePoints[adjacentKey] = 1
-              points.append(adjacentPoint)
+    adjacentMasks = self.adjacentMasks
+    slideOffsets = Hive.SLIDE_OFFSETS
+    liftedMasks[cellId] = adjacentMasks.get(cellId, 0)
+    reachedCells = set([cellId])
+    frontier = [cellId]
+    while frontier:
+      localCell = frontier.pop()
+      adjacentMask = liftedMasks[localCell] if localCell in liftedMasks else adjacentMasks.get(localCell, 0)
+      for offset in slideOffsets[adjacentMask]:
+        adjacentCell = localCell + offset
+        if adjacentCell == targetCell:
+          return True
+        if not adjacentCell in reachedCells:
+          reachedCells.add(adjacentCell)
+          frontier.append(adjacentCell)
+    return False
+
+
+  def traversePerimeter(self, startCell, liftedMasks = None):
+    """ 
+      The hexes reachable from startCell along the perimeter graph (including startCell).
+      liftedMasks (cell -> adjacency mask) stands in for the current masks where given, e.g. with a piece lifted.
+      An iterative flood fill, so long snaking hives cost neither deep Python frames nor the recursion limit.
+    """
+    adjacentMasks = self.adjacentMasks
+    slideOffsets = Hive.SLIDE_OFFSETS
+    reachedCells = set([startCell])
+    frontier = [startCell]
+    while frontier:
+      cellId = frontier.pop()
+      if liftedMasks and cellId in liftedMasks:
+        adjacentMask = liftedMasks[cellId]
+      else:
+        adjacentMask = adjacentMasks.get(cellId, 0)
+      for offset in slideOffsets[adjacentMask]:
+        adjacentCell = cellId + offset
+        if not adjacentCell in reachedCells:
+          reachedCells.add(adjacentCell)
+          frontier.append(adjacentCell)
+    return reachedCells
+
+
+  def traverseHive(self, startCell, liftedCell = None):
+    """ 
+      The occupied hexes connected to startCell (including it), optionally as if the single piece at liftedCell were picked up.
+      An iterative flood fill like traversePerimeter.
+    """
+    board = self.board
+    reachedCells = set([startCell, liftedCell])
+    frontier = [startCell]
+    while frontier:
+      cellId = frontier.pop()
+      for offset in Hive.ADJACENT_OFFSETS:
+        adjacentCell = cellId + offset
+        if adjacentCell in board and not adjacentCell in reachedCells:
+          reachedCells.add(adjacentCell)
+          frontier.append(adjacentCell)
+    reachedCells.discard(liftedCell)
+    return reachedCells
+
+
+  def isConnected(self, liftedCell = None):
+    """ one hive check by traversal (getPinnedCells answers it for every piece at once) """
+    cells = [cellId for cellId in self.board if not cellId == liftedCell]
+    if not cells:
+      return True
+    return len(self.traverseHive(cells[0], liftedCell)) == len(cells)
+
+
+  def _updateEntryCell(self, cellId):
+    whiteCount = self.adjacentColorCounts['w'].get(cellId, 0)
+    blackCount = self.adjacentColorCounts['b'].get(cellId, 0)
+    isEmpty = not cellId in self.board
+
+    if isEmpty and whiteCount and not blackCount:
+      self.entryCells['w'].add(cellId)
+    else:
+      self.entryCells['w'].discard(cellId)
 
-    return points; 
+    if isEmpty and blackCount and not whiteCount:
+      self.entryCells['b'].add(cellId)
+    else:
+      self.entryCells['b'].discard(cellId)
 
 
   def isBrokenWithoutPiece(self, piece):
     if self.numberOfPieces == 0:
       return False
-  
-    self.pickupPiece(piece)
-
-    # get a random piece for the root
-    key = self.board.keys()[0]
-    root = self.board[key][-1]
-
-    # try to visit all pieces in the hive
-    visitedPieces = dict()
-    self._visitPiece(root, visitedPieces)
-
-    self.putdownPiece(piece, piece.point)
-
-    # if all pieces were vistited the hive is still connected
-    return not len(visitedPieces) == self.numberOfPieces - 1
 
+    # the pieces around one unbroken arc stay joined through each other, only other pieces need the whole hive's pinned cells
+    cellId = self.getCellId(piece.point)
+    if Hive.IS_ONE_ARC[self.adjacentMasks.get(cellId, 0)]:
+      return False
+    return cellId in self.getPinnedCells()
+
+
+  def getPinnedCells(self):
+    """ 
+      The cells whose top piece cannot be picked up without breaking the hive in two.
+      These are the articulation points of the graph of occupied cells (ignoring stacks, where the hive stays put). 
+      The result is cached per Zobrist state so move generation and evaluation share the same pass.
+    """
+    return self._getAnalysis('pinnedCells', self._findPinnedCells)
+
+
+  def _getAnalysis(self, name, analyse):
+    """ results of whole position analyses, cached per Zobrist state (with the cell total telling apart states the window wraps onto each other) """
+    key = (self.zobrist.currentState, self.cellTotal, name)
+    analysis = self.analysisCache.get(key)
+    if analysis is None:
+      analysis = analyse()
+      self.analysisCache.put(key, analysis)
+    return analysis
+
+
+  def _findPinnedCells(self):
+    """ Tarjan's articulation point search as an iterative depth first traversal """
+    board = self.board
+    pinnedCells = set()
+    if len(board) < 3:
+      return frozenset(pinnedCells)
+
+    root = iter(board).next()
+    depth = {root: 0}
+    low = {root: 0}
+    rootChildren = 0
+
+    stack = [[root, None, 0]] # cell, parent cell, next adjacency index
+    while stack:
+      frame = stack[-1]
+      cellId = frame[0]
+      index = frame[2]
+      if index < 6:
+        frame[2] = index + 1
+        adjacentCell = cellId + Hive.ADJACENT_OFFSETS[index]
+        if adjacentCell in board:
+          if not adjacentCell in depth:
+            depth[adjacentCell] = low[adjacentCell] = len(depth)
+            stack.append([adjacentCell, cellId, 0])
+          elif not adjacentCell == frame[1]:
+            low[cellId] = min(low[cellId], depth[adjacentCell])
+      else:
+        stack.pop()
+        parentCell = frame[1]
+        if parentCell is None:
+          continue
+        low[parentCell] = min(low[parentCell], low[cellId])
+        if parentCell == root:
+          rootChildren += 1
+        elif low[cellId] >= depth[parentCell]:
+          pinnedCells.add(parentCell)
 
-  def _visitPiece(self, piece, visitedPieces):
-    for p in self.getPiecesAtPoint(piece.point):
-      visitedPieces[p.getNotation()] = 1
+    if rootChildren > 1:
+      pinnedCells.add(root)
 
-    adjacentPoints = self.getAdjacentPoints(piece.point)
-    for point in adjacentPoints:
-      topPiece = self.getTopPieceAtPoint(point)
-      if topPiece and not visitedPieces.has_key(topPiece.getNotation()):
-        self._visitPiece(topPiece, visitedPieces)
+    # picking up the top of a stack leaves the cell occupied
+    return frozenset(cellId for cellId in pinnedCells if len(board[cellId]) == 1)
 
 
   def getPiece(self, (color, kind, number)):
-    for key, pieces in self.board.iteritems():
-      for piece in pieces:
-        if piece.color == color and piece.kind == kind and str(piece.number) == number:
-          return piece
-    return None 
+    return self.playedPieces.get(color + kind + number)
 
   
   def getRelativePoint(self, piece, relativePiece, relativePosition):
@@ -270,50 +608,112 @@ class Hive:
 
 
   def pickupPiece(self, piece):
-    key = self.getBoardKey(piece.point)
-    if len(self.board[key]) == 1:
-      del self.board[key]
+    cellId = self.getCellId(piece.point)
+    pieces = self.board[cellId]
+    if len(pieces) == 1:
+      del self.board[cellId]
+      self._updateAdjacentMasks(cellId, False)
+      self._updateBounds(cellId, False)
+      self._updateTopPiece(cellId, piece, None)
     else:
-      self.board[key].remove(piece)
-    self.zobrist.updateState(piece)
+      pieces.remove(piece)
+      self._updateTopPiece(cellId, piece, pieces[-1])
+    del self.playedPieces[piece.getNotation()]
+    if piece.kind == 'Q':
+      del self.queenCells[piece.color]
+    self.zobrist.updateState(piece, cellId)
+    self.cellTotal -= cellId
     self.numberOfPieces -= 1
+    if self.planes:
+      self.planes.updateCell(cellId)
 
 
   def putdownPiece(self, piece, point):
-    key = self.getBoardKey(point)
-    if self.board.has_key(key):
-      z = -1
-      for p in self.board[key]:
-        z = max(p.point.z, z)
-      z += 1
-      point = Point(point.x, point.y, z)
-      self.board[key].append(piece)
+    cellId = self.getCellId(point)
+    pieces = self.board.get(cellId)
+    if pieces:
+      point = Point(point.x, point.y, len(pieces))
+      self._updateTopPiece(cellId, pieces[-1], piece)
+      pieces.append(piece)
     else:
-      self.board[key] = [piece]
+      self.board[cellId] = [piece]
+      self._updateAdjacentMasks(cellId, True)
+      self._updateBounds(cellId, True)
+      self._updateTopPiece(cellId, None, piece)
 
     piece.point = point
-    self.zobrist.updateState(piece)
+    self.playedPieces[piece.getNotation()] = piece
+    if piece.kind == 'Q':
+      self.queenCells[piece.color] = cellId
+    self.zobrist.updateState(piece, cellId)
+    self.cellTotal += cellId
     self.numberOfPieces += 1
+    if self.planes:
+      self.planes.updateCell(cellId)
+
+
+  def putdownPieces(self, placements):
+    """ putdownPiece for each (piece, point), bottom of each stack first, working out the adjacency state once at the end """
+    for piece, point in placements:
+      cellId = self.getCellId(point)
+      pieces = self.board.setdefault(cellId, [])
+      if not pieces:
+        self._updateBounds(cellId, True)
+      piece.point = Point(point.x, point.y, len(pieces))
+      pieces.append(piece)
+      self.playedPieces[piece.getNotation()] = piece
+      if piece.kind == 'Q':
+        self.queenCells[piece.color] = cellId
+      self.zobrist.updateState(piece, cellId)
+      self.cellTotal += cellId
+      self.numberOfPieces += 1
+    self._rebuildAdjacency()
+    if self.planes:
+      self.planes.recentre()
+
+
+  def _rebuildAdjacency(self):
+    """ the adjacent masks, color counts, perimeter and entry cells worked out from the board """
+    board = self.board
+    adjacentMasks = dict()
+    adjacentColorCounts = {'w': dict(), 'b': dict()}
+    for cellId, pieces in board.iteritems():
+      counts = adjacentColorCounts[pieces[-1].color]
+      for index, offset in enumerate(Hive.ADJACENT_OFFSETS):
+        adjacentCell = cellId + offset
+        adjacentMasks[adjacentCell] = adjacentMasks.get(adjacentCell, 0) | (1 << ((index + 3) % 6))
+        counts[adjacentCell] = counts.get(adjacentCell, 0) + 1
+
+    self.adjacentMasks = adjacentMasks
+    self.adjacentColorCounts = adjacentColorCounts
+    self.perimeterCells = set([cellId for cellId in adjacentMasks if not cellId in board])
+    (whiteCounts, blackCounts) = (adjacentColorCounts['w'], adjacentColorCounts['b'])
+    self.entryCells = {
+      'w': set([cellId for cellId in whiteCounts if not cellId in blackCounts and not cellId in board]),
+      'b': set([cellId for cellId in blackCounts if not cellId in whiteCounts and not cellId in board])}
   
 
   def getSurroundedQueenColors(self):
     surrounded = []
+    for color, cellId in self.queenCells.iteritems():
+      if self.adjacentMasks.get(cellId) == Hive.SURROUNDED_MASK:
+        surrounded.append(color)
+    return surrounded
 
-    for key, pieces in self.board.iteritems():
-      for piece in pieces:
-        if piece.kind == 'Q':
-          isSurrounded = True
-          for point in self.getAdjacentPoints(piece.point):
-            if not self.getTopPieceAtPoint(point):
-              isSurrounded = False
-              break
-          if isSurrounded:
-            surrounded.append(piece.color)
 
-    return surrounded
+  def getQueenAdjacentCount(self, color):
+    """ number of occupied hexes around color's queen bee (0 if the queen has not been played) """
+    if not color in self.queenCells:
+      return 0
+    return Hive.ADJACENT_COUNTS[self.adjacentMasks.get(self.queenCells[color], 0)]
 
 
   def printBoard(self):
+    sys.stderr.write(self.getBoardString())
+
+
+  def getBoardString(self):
+    """ the ASCII rendering of the board (array rows from getBoardArrayLimits, one piece wide margin) """
     limits = self.getBoardArrayLimits()
     limits[0] -= 1
     limits[1] -= 1
@@ -335,10 +735,10 @@ class Hive:
       sx = offsetx + 2
       for arrx in range(limits[0], limits[2] + 1, 1):
         #array to hex
-        hexx = arrx - int(math.floor(float(arry)/2))
-        hexy = arrx + int(math.ceil(float(arry)/2))
+        hexx = arrx - (arry >> 1)
+        hexy = arrx + ((arry + 1) >> 1)
 
-        piece = self.getTopPieceAtPoint(Point(hexx,hexy,0))
+        piece = self.getTopPieceAtCell((hexx << CELL_SHIFT) + hexy)
         if piece:
           s0[sx-1] = '/'
           s0[sx+1] = '\\'
@@ -362,25 +762,24 @@ class Hive:
       s1 = [' '] * swidth
     s.insert(0,s2)
 
-    for si in s:
-      sys.stderr.write('# ' + ''.join(si) + '\n')
-    sys.stderr.write('#\n')
+    return ''.join(['# ' + ''.join(si) + '\n' for si in s]) + '#\n'
 
 
   def getBoardArrayLimits(self):
-    limits = [float('inf'), float('inf'), float('-inf'), float('-inf')] # xmin, ymin, xmax, ymax
-    for key, pieces in self.board.iteritems():
-      piece = pieces[0]
-      arrx = int(math.floor(float(piece.point.x + piece.point.y) / 2))
-      arry = piece.point.y - piece.point.x
-
-      limits[0] = min(limits[0], arrx)
-      limits[1] = min(limits[1], arry)
-      limits[2] = max(limits[2], arrx)
-      limits[3] = max(limits[3], arry)
-
-    if limits[0] == float('inf'):
-      limits = [0, 0, 0, 0]
-
-    return limits 
+    """ [xmin, ymin, xmax, ymax] of the occupied cells in array space, from the row and column counts kept by _updateBounds """
+    if not self.columnCounts:
+      return [0, 0, 0, 0]
+    return [min(self.columnCounts), min(self.rowCounts), max(self.columnCounts), max(self.rowCounts)]
+
+
+  def _updateBounds(self, cellId, isOccupied):
+    """ count cellId in or out of its array column and row """
+    x = (cellId + CELL_HALF) >> CELL_SHIFT
+    y = cellId - (x << CELL_SHIFT)
+    for counts, value in ((self.columnCounts, (x + y) >> 1), (self.rowCounts, y - x)):
+      count = counts.get(value, 0) + (1 if isOccupied else -1)
+      if count:
+        counts[value] = count
+      else:
+        del counts[value]
 
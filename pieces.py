@@ -1,29 +1,44 @@
 from collections import namedtuple
 
+# packed cell ids of the points of a hive: (x << CELL_SHIFT) + y, with y within +/- CELL_HALF of the origin
+CELL_SHIFT = 12
+CELL_HALF = 1 << (CELL_SHIFT - 1)
+
 class Point(namedtuple('Point', ['x', 'y', 'z'])):
   NONE = (None, None, None)
   __slots__ = ()
 
-class Piece:
+class Piece(object):
   (COLORSTRING, KINDSTRING) = ('wb', 'ABGQSML')
 
+  # a player's pieces (kind + number) in the order of their ids, expansion pieces last
+  KEYS = ('Q', 'S1', 'S2', 'B1', 'B2', 'A1', 'A2', 'A3', 'G1', 'G2', 'G3', 'M', 'L')
+
+  # subclasses add no attributes (__slots__ = ()), so every piece stays this compact
+  __slots__ = ('color', 'kind', 'number', 'point', 'id', 'colorIndex', 'kindIndex', 'kindId', 'notation')
+
   def __init__(self, color, kind, number):
     self.color = color # w, b
     self.kind = kind # A, B, G, Q, S
     self.number = number # '', 1, 2, 3
     self.point = Point.NONE # (x,y,z)
+    self.colorIndex = Piece.COLORSTRING.index(color)
+    self.kindIndex = Piece.KINDSTRING.index(kind)
+    self.kindId = self.colorIndex * len(Piece.KINDSTRING) + self.kindIndex # shared by the pieces of a color and kind
+    self.id = self.colorIndex * len(Piece.KEYS) + Piece.KEYS.index(kind + str(number)) # unique among the pieces of a game
+    self.notation = color + kind + str(number)
 
 
   def getColorIndex(self):
-    return Piece.COLORSTRING.index(self.color)
+    return self.colorIndex
 
 
   def getKindIndex(self):
-    return Piece.KINDSTRING.index(self.kind)
+    return self.kindIndex
 
 
   def getNotation(self):
-    return self.color + self.kind + str(self.number)
+    return self.notation
 
 
   def isPlayed(self):
@@ -38,7 +53,17 @@ class Piece:
     elif hive.isBrokenWithoutPiece(self): # if picking up breaks hive: 0 possible points
       return []
 
-    return None
+    return [hive.getCellPoint(cellId) for cellId in self.getMoveCells(hive)]
+
+
+  def getMoveCells(self, hive):
+    """ the cells the piece can move to, for a piece on top of its stack that can be lifted without breaking the hive """
+    return []
+
+
+  def canReachCell(self, hive, cellId):
+    """ whether cellId is one of getMoveCells, the kinds with long moves answer without generating them all """
+    return cellId in self.getMoveCells(hive)
 
 
   def isPinned(self, hive):
@@ -62,48 +87,26 @@ class QueenBeePiece(Piece):
   """
     The Queen Bee piece. It moves one hex at a time and cannot be surrounded or the player looses.
   """
+  __slots__ = ()
+
   def __init__(self, color, number = ''):
     Piece.__init__(self, color, 'Q', number)
 
 
-  def getPossiblePoints(self, hive):
-    possiblePoints = Piece.getPossiblePoints(self, hive)
-    if not possiblePoints == None:
-      return possiblePoints
-
+  def getMoveCells(self, hive):
     # can move 1 empty hex away, but cannot enter gates
-    possiblePoints = []
 
     # can't move if pinned (needs 2 adjacent points to move through)
     if not hive.hasTwoEmptyAdjacentPoints(self.point):
-      return possiblePoints 
-    
-    hive.pickupPiece(self)
-
-    adjacentPoints = hive.getAdjacentPoints(self.point)
-
-    # partition adjacent points into occupied and slidable
-    occupiedAdjacentPoints = []
-    slidableAdjacentPoints = []
-    for index, adjacentPoint in enumerate(adjacentPoints):
-      if hive.getTopPieceAtPoint(adjacentPoint):
-        occupiedAdjacentPoints.append(adjacentPoint)
-      else:
-        easterPoint = hive.getAdjacentPoint(self.point, ((index - 1) % 6))
-        westerPoint = hive.getAdjacentPoint(self.point, ((index + 1) % 6))
-        if not hive.getTopPieceAtPoint(easterPoint) or not hive.getTopPieceAtPoint(westerPoint):
-          slidableAdjacentPoints.append(adjacentPoint)
-
-    # check slidable adjacencies for valid moves (must be adjacent to one of the occupied adjacencies)
-    for slidableAdjacentPoint in slidableAdjacentPoints:
-      for occupiedAdjacentPoint in occupiedAdjacentPoints:
-        if hive.arePointsAdjacent(slidableAdjacentPoint, occupiedAdjacentPoint):
-          possiblePoints.append(slidableAdjacentPoint)
-          break
+      return []
     
-    hive.putdownPiece(self, self.point)
+    # one step along the perimeter graph (the queen's own hex is never a flank of its own step, so there is no need to pick it up)
+    cellId = hive.getCellId(self.point)
+    return [cellId + offset for offset in hive.SLIDE_OFFSETS[hive.getAdjacentMask(cellId)]]
+
 
-    return possiblePoints
+  def canReachCell(self, hive, cellId):
+    return cellId in QueenBeePiece.getMoveCells(self, hive)
 
   def isPinned(self, hive):
     return Piece.isPinned(self, hive) and not hive.hasTwoEmptyAdjacentPoints(self.point)
@@ -113,58 +116,50 @@ class SpiderPiece(Piece):
   """
     The Spider piece. It moves exactly three hexes at a time.
   """
+  __slots__ = ()
+
   def __init__(self, color, number):
     Piece.__init__(self, color, 'S', number)
 
 
-  def getPossiblePoints(self, hive):
-    possiblePoints = Piece.getPossiblePoints(self, hive)
-    if not possiblePoints == None:
-      return possiblePoints
-
+  def getMoveCells(self, hive):
     # can move 3 emtpy hex away, but cannot enter gates and cannot backtrack
-    possiblePoints = []
+    possibleCells = set()
 
     # can't move if pinned (needs 2 adjacent points to move through)
     if not hive.hasTwoEmptyAdjacentPoints(self.point):
-      return possiblePoints 
+      return possibleCells
 
-    # find all 3 node segments in the graph that is the non-gate border nodes starting at the current node
-    hive.pickupPiece(self)
-    self._visitPoint(self.point, 0, [], possiblePoints, hive)
-    hive.putdownPiece(self, self.point)
+    # find all 3 node segments in the graph that is the non-gate border nodes starting at the current node,
+    # with the adjacency masks the spider's empty adjacent hexes have once it is lifted (instead of picking it up)
+    cellId = hive.getCellId(self.point)
+    liftedMasks = hive.getLiftedMasks(cellId)
+    liftedMasks[cellId] = hive.getAdjacentMask(cellId)
+    SpiderPiece._visitCell(self, cellId, 0, [], possibleCells, hive, liftedMasks)
 
-    return possiblePoints
+    return possibleCells
 
 
-  def _visitPoint(self, point, depth, currentPath, possiblePoints, hive):
+  def canReachCell(self, hive, cellId):
+    # the walk ends 3 hexes away at most
+    if hive.getDistanceBetweenPoints(self.point, hive.getCellPoint(cellId)) > 3:
+      return False
+    return cellId in SpiderPiece.getMoveCells(self, hive)
+
+
+  def _visitCell(self, cellId, depth, currentPath, possibleCells, hive, liftedMasks):
     if depth == 3:
-      if not point in possiblePoints:
-        possiblePoints.append(point)
-        return
-
-    currentPath.append(point)
-
-    # get adjacencies
-    adjacentPoints = hive.getAdjacentPoints(point)
-
-    # partition into occupied and slidable
-    occupiedAdjacentPoints = []
-    slidableAdjacentPoints = []
-    for index, adjacentPoint in enumerate(adjacentPoints):
-      if hive.getTopPieceAtPoint(adjacentPoint):
-        occupiedAdjacentPoints.append(adjacentPoint)
-      else:
-        easterPoint = hive.getAdjacentPoint(point, ((index - 1) % 6))
-        westerPoint = hive.getAdjacentPoint(point, ((index + 1) % 6))
-        if not hive.getTopPieceAtPoint(easterPoint) or not hive.getTopPieceAtPoint(westerPoint):
-          slidableAdjacentPoints.append(adjacentPoint)
-    
-    for slidableAdjacentPoint in slidableAdjacentPoints:
-      for occupiedAdjacentPoint in occupiedAdjacentPoints:
-        if not slidableAdjacentPoint in currentPath and hive.arePointsAdjacent(slidableAdjacentPoint, occupiedAdjacentPoint):
-          self._visitPoint(slidableAdjacentPoint, depth + 1, currentPath, possiblePoints, hive)
-          break
+      possibleCells.add(cellId)
+      return
+
+    currentPath.append(cellId)
+
+    # walk the perimeter graph without backtracking
+    adjacentMask = liftedMasks[cellId] if cellId in liftedMasks else hive.getAdjacentMask(cellId)
+    for offset in hive.SLIDE_OFFSETS[adjacentMask]:
+      adjacentCell = cellId + offset
+      if not adjacentCell in currentPath:
+        SpiderPiece._visitCell(self, adjacentCell, depth + 1, currentPath, possibleCells, hive, liftedMasks)
 
     currentPath.pop()
 
@@ -176,113 +171,66 @@ class BeetlePiece(Piece):
   """
     The Beetle piece. It moves exactly one hexes at a time, but can cover other pieces.
   """
+  __slots__ = ()
+
   def __init__(self, color, number):
     Piece.__init__(self, color, 'B', number)
 
 
-  def getPossiblePoints(self, hive):
-    possiblePoints = Piece.getPossiblePoints(self, hive)
-    if not possiblePoints == None:
-      return possiblePoints
+  def getMoveCells(self, hive):
+    possibleCells = []
+    board = hive.board
+    cellId = hive.getCellId(self.point)
+    isOnTop = self.point.z > 0 and self == hive.getTopPieceAtCell(cellId)
 
-    possiblePoints = []
+    # the beetle's own hex is never an adjacency or a flank of its own step, so there is no need to pick it up
 
-    # partition adjacencies into climbable (up or down) and slidable
-    adjacentPoints = hive.getAdjacentPoints(self.point)
-    climbableAdjacentPoints = []
-    slidableAdjacentPoints = []
-    
-    if self.point.z > 0 and self == hive.getTopPieceAtPoint(self.point): # beetle on top: can possibly climb onto any adjacent hex
-      climbableAdjacentPoints = adjacentPoints
-    else: # beetle on ground: can move 1 hex away (occupied or not), but cannot enter gates
-      for index, adjacentPoint in enumerate(adjacentPoints):
-        if hive.getTopPieceAtPoint(adjacentPoint):
-          climbableAdjacentPoints.append(adjacentPoint)
-        else:
-          easterPoint = hive.getAdjacentPoint(self.point, ((index - 1) % 6))
-          westerPoint = hive.getAdjacentPoint(self.point, ((index + 1) % 6))
-          if not hive.getTopPieceAtPoint(easterPoint) or not hive.getTopPieceAtPoint(westerPoint):
-            slidableAdjacentPoints.append(adjacentPoint)
-
-
-    hive.pickupPiece(self)
-
-    # queen style move on ground 
-    for slidableAdjacentPoint in slidableAdjacentPoints:
-      for climbableAdjacentPoint in climbableAdjacentPoints:
-        if hive.arePointsAdjacent(slidableAdjacentPoint, climbableAdjacentPoint):
-          possiblePoints.append(slidableAdjacentPoint)
-          break
-
-    # climbing style move (can't climb through gates)
-    for adjacentPoint in climbableAdjacentPoints:
-      index = hive.getAdjacencyIndex(self.point, adjacentPoint)
-      adjacentPiece = hive.getTopPieceAtPoint(adjacentPoint)
-      adjacentHeight = -1
-      if adjacentPiece:
-        adjacentHeight = adjacentPiece.point.z
-      easterPoint = hive.getAdjacentPoint(self.point, ((index - 1) % 6))
-      easterPiece = hive.getTopPieceAtPoint(easterPoint)
-      westerPoint = hive.getAdjacentPoint(self.point, ((index + 1) % 6))
-      westerPiece = hive.getTopPieceAtPoint(westerPoint)
+    # queen style move on ground: one step along the perimeter graph
+    if not isOnTop:
+      for offset in hive.SLIDE_OFFSETS[hive.getAdjacentMask(cellId)]:
+        possibleCells.append(cellId + offset)
+
+    # climbing style move (can't climb through gates), on top of the hive any adjacency may be climbed onto
+    for offset, easterOffset, westerOffset in hive.ADJACENT_FLANKS:
+      adjacentCell = cellId + offset
+      adjacentPieces = board.get(adjacentCell)
+      if not adjacentPieces and not isOnTop:
+        continue
+
+      easterPieces = board.get(cellId + easterOffset)
+      westerPieces = board.get(cellId + westerOffset)
+      adjacentHeight = len(adjacentPieces) - 1 if adjacentPieces else -1
       minSideHeight = float('inf')
-      if easterPiece: 
-        minSideHeight = min(minSideHeight, easterPiece.point.z)
-      if westerPiece: 
-        minSideHeight = min(minSideHeight, westerPiece.point.z)
+      if easterPieces: 
+        minSideHeight = min(minSideHeight, len(easterPieces) - 1)
+      if westerPieces: 
+        minSideHeight = min(minSideHeight, len(westerPieces) - 1)
       if minSideHeight == float('inf') or minSideHeight <= self.point.z or minSideHeight < adjacentHeight:
-        possiblePoints.append(adjacentPoint)
+        possibleCells.append(adjacentCell)
+
+    return possibleCells
 
-    hive.putdownPiece(self, self.point)
 
-    return possiblePoints
+  def canReachCell(self, hive, cellId):
+    return cellId in BeetlePiece.getMoveCells(self, hive)
 
 
 class AntPiece(Piece):
   """
     The Ant piece. It moves anywhere on the outside of the hive.
   """
+  __slots__ = ()
+
   def __init__(self, color, number):
     Piece.__init__(self, color, 'A', number)
 
-  def getPossiblePoints(self, hive):
-    possiblePoints = Piece.getPossiblePoints(self, hive)
-    if not possiblePoints == None:
-      return possiblePoints
-
-    # can move to any non-gate hex around hive
-    possiblePoints = []
-
-    hive.pickupPiece(self)
-    self._visitPoint(self.point, possiblePoints, hive)
-    possiblePoints.remove(self.point)
-    hive.putdownPiece(self, self.point)
-
-    return possiblePoints
-
-  def _visitPoint(self, point, possiblePoints, hive):
-    possiblePoints.append(point)
-    adjacentPoints = hive.getAdjacentPoints(point)
-
-    # partition into occupied and slidable
-    occupiedAdjacentPoints = []
-    slidableAdjacentPoints = []
-    for index, adjacentPoint in enumerate(adjacentPoints):
-      if hive.getTopPieceAtPoint(adjacentPoint):
-        occupiedAdjacentPoints.append(adjacentPoint)
-      else:
-        easterPoint = hive.getAdjacentPoint(point, ((index - 1) % 6))
-        westerPoint = hive.getAdjacentPoint(point, ((index + 1) % 6))
-        easterPiece = hive.getTopPieceAtPoint(easterPoint)
-        westerPiece = hive.getTopPieceAtPoint(westerPoint)
-        if not hive.getTopPieceAtPoint(easterPoint) or not hive.getTopPieceAtPoint(westerPoint):
-          slidableAdjacentPoints.append(adjacentPoint)
-
-    for slidableAdjacentPoint in slidableAdjacentPoints:
-      for occupiedAdjacentPoint in occupiedAdjacentPoints:
-        if hive.arePointsAdjacent(slidableAdjacentPoint, occupiedAdjacentPoint) and not slidableAdjacentPoint in possiblePoints: 
-          self._visitPoint(slidableAdjacentPoint, possiblePoints, hive)
-          break
+  def getMoveCells(self, hive):
+    # can move to any non-gate hex around hive: the perimeter graph (without the ant) reachable from its hex
+    return hive.getSlideReachableCells(hive.getCellId(self.point))
+
+
+  def canReachCell(self, hive, cellId):
+    return hive.isSlideReachable(hive.getCellId(self.point), cellId)
 
 
   def isPinned(self, hive):
@@ -293,80 +241,31 @@ class GrasshopperPiece(Piece):
   """
     The Grasshopper piece. It moves in a straight line over other pieces.
   """
+  __slots__ = ()
+
   def __init__(self, color, number):
     Piece.__init__(self, color, 'G', number)
 
 
-  def getPossiblePoints(self, hive):
-    possiblePoints = Piece.getPossiblePoints(self, hive)
-    if not possiblePoints == None:
-      return possiblePoints
-
+  def getMoveCells(self, hive):
     # can move in straight lines from current hex, but must stop at first space 
     # in each direction, starting one occupied space over, find first borderPoint
-    possiblePoints = []
-
-    #(x+1, y) NORTHEAST
-    point = Point(self.point.x + 1, self.point.y, 0)
-    piece = hive.getTopPieceAtPoint(point)
-    if piece:
-      while True:
-        point = Point(point.x + 1, point.y, 0)
-        if not hive.getTopPieceAtPoint(point):
-          possiblePoints.append(point)
-          break
-
-    #(x+1, y+1) EAST
-    point = Point(self.point.x + 1, self.point.y + 1, 0)
-    piece = hive.getTopPieceAtPoint(point)
-    if piece:
-      while True:
-        point = Point(point.x + 1, point.y + 1, 0)
-        if not hive.getTopPieceAtPoint(point):
-          possiblePoints.append(point)
-          break
-
-    #(x, y+1) SOUTHEAST
-    point = Point(self.point.x, self.point.y + 1, 0)
-    piece = hive.getTopPieceAtPoint(point)
-    if piece:
-      while True:
-        point = Point(point.x, point.y + 1, 0)
-        if not hive.getTopPieceAtPoint(point):
-          possiblePoints.append(point)
-          break
-
-    #(x-1, y) SOUTHWEST
-    point = Point(self.point.x - 1, self.point.y, 0)
-    piece = hive.getTopPieceAtPoint(point)
-    if piece:
-      while True:
-        point = Point(point.x - 1, point.y, 0)
-        if not hive.getTopPieceAtPoint(point):
-          possiblePoints.append(point)
-          break
-
-    #(x-1, y-1) WEST
-    point = Point(self.point.x - 1, self.point.y - 1, 0)
-    piece = hive.getTopPieceAtPoint(point)
-    if piece:
-      while True:
-        point = Point(point.x - 1, point.y - 1, 0)
-        if not hive.getTopPieceAtPoint(point):
-          possiblePoints.append(point)
-          break
-
-    #(x, y-1) NORTHWEST
-    point = Point(self.point.x, self.point.y - 1, 0)
-    piece = hive.getTopPieceAtPoint(point)
-    if piece:
-      while True:
-        point = Point(point.x, point.y - 1, 0)
-        if not hive.getTopPieceAtPoint(point):
-          possiblePoints.append(point)
-          break
-
-    return possiblePoints
+    possibleCells = []
+
+    board = hive.board
+    cellId = hive.getCellId(self.point)
+    for offset in hive.ADJACENT_OFFSETS:
+      adjacentCell = cellId + offset
+      if adjacentCell in board:
+        while adjacentCell in board:
+          adjacentCell += offset
+        possibleCells.append(adjacentCell)
+
+    return possibleCells
+
+
+  def canReachCell(self, hive, cellId):
+    return cellId in GrasshopperPiece.getMoveCells(self, hive)
 
 
   
@@ -374,59 +273,58 @@ class LadybugPiece(Piece):
   """
     The Ladybug piece. It moves 2 hexes ontop of the hive and then one hex to get off the hive.
   """
+  __slots__ = ()
+
   def __init__(self, color, number = ''):
     Piece.__init__(self, color, 'L', number)
 
 
-  def getPossiblePoints(self, hive):
-    possiblePoints = Piece.getPossiblePoints(self, hive)
-    if not possiblePoints == None:
-      return possiblePoints
+  def getMoveCells(self, hive):
+    possibleCells = set()
+
+    # the walk treats the ladybug's own hex (the start of the path) as empty instead of picking it up,
+    # and goes through the class since a mosquito lent the move would find SpiderPiece._visitCell first
+    LadybugPiece._visitCell(self, hive.getCellId(self.point), 0, [], possibleCells, hive)
 
-    possiblePoints = []
+    return possibleCells
 
-    hive.pickupPiece(self)
-    self._visitPoint(self.point, 0, [], possiblePoints, hive)
-    hive.putdownPiece(self, self.point)
 
-    return possiblePoints
+  def canReachCell(self, hive, cellId):
+    return cellId in LadybugPiece.getMoveCells(self, hive)
 
 
-  def _visitPoint(self, point, depth, currentPath, possiblePoints, hive):
+  def _visitCell(self, cellId, depth, currentPath, possibleCells, hive):
     if depth == 3:
-      if not point in possiblePoints:
-        possiblePoints.append(point)
-        return
+      possibleCells.add(cellId)
+      return
 
-    currentPath.append(point)
+    currentPath.append(cellId)
 
-    pieceHeight = -1
-    piece = hive.getTopPieceAtPoint(point)
-    if piece:
-      pieceHeight = piece.point.z
+    board = hive.board
+    liftedCell = currentPath[0]
+    pieceHeight = hive.getHeight(cellId) - 1 if depth else -1
     
-    for index, adjacentPoint in enumerate(hive.getAdjacentPoints(point)):
-      if not adjacentPoint in currentPath:
-        adjacentPiece = hive.getTopPieceAtPoint(adjacentPoint)
+    for offset, easterOffset, westerOffset in hive.ADJACENT_FLANKS:
+      adjacentCell = cellId + offset
+      if not adjacentCell in currentPath:
+        adjacentPieces = board.get(adjacentCell)
         adjacentHeight = -1
-        if adjacentPiece:
-          adjcentHeight = adjacentPiece.point.z
+        if adjacentPieces:
+          adjcentHeight = len(adjacentPieces) - 1
 
-        easterPoint = hive.getAdjacentPoint(point, ((index - 1) % 6))
-        easterPiece = hive.getTopPieceAtPoint(easterPoint)
-        westerPoint = hive.getAdjacentPoint(point, ((index + 1) % 6))
-        westerPiece = hive.getTopPieceAtPoint(westerPoint)
+        easterPieces = board.get(cellId + easterOffset) if not cellId + easterOffset == liftedCell else None
+        westerPieces = board.get(cellId + westerOffset) if not cellId + westerOffset == liftedCell else None
         minSideHeight = float('inf')
-        if easterPiece: 
-          minSideHeight = min(minSideHeight, easterPiece.point.z)
-        if westerPiece: 
-          minSideHeight = min(minSideHeight, westerPiece.point.z)
+        if easterPieces: 
+          minSideHeight = min(minSideHeight, len(easterPieces) - 1)
+        if westerPieces: 
+          minSideHeight = min(minSideHeight, len(westerPieces) - 1)
 
         if minSideHeight == float('inf') or minSideHeight <= pieceHeight or minSideHeight < adjacentHeight:
-          if depth in (0,1) and adjacentPiece:
-              self._visitPoint(adjacentPoint, depth + 1, currentPath, possiblePoints, hive)
-          elif depth == 2 and not adjacentPiece:
-            self._visitPoint(adjacentPoint, depth + 1, currentPath, possiblePoints, hive)
+          if depth in (0,1) and adjacentPieces:
+              LadybugPiece._visitCell(self, adjacentCell, depth + 1, currentPath, possibleCells, hive)
+          elif depth == 2 and not adjacentPieces:
+            LadybugPiece._visitCell(self, adjacentCell, depth + 1, currentPath, possibleCells, hive)
 
     currentPath.pop()
 
@@ -435,25 +333,40 @@ class MosquitoPiece(QueenBeePiece, SpiderPiece, BeetlePiece, AntPiece, Grasshopp
   """
     The Mosquito piece. It moves like any of the piece types that it is adjacent to (unless it is beetling on top of the hive)
   """
+  __slots__ = ()
+
   def __init__(self, color, number = ''):
     Piece.__init__(self, color, 'M', number)
 
 
-  def getPossiblePoints(self, hive):
-    possiblePoints = Piece.getPossiblePoints(self, hive)
-    if not possiblePoints == None:
-      return possiblePoints
-
-    possiblePoints = []
-
-    if self.point.z > 0 and self == hive.getTopPieceAtPoint(self.point): # on top: can only move as beetle
-      possiblePoints = BeetlePiece.getPossiblePoints(self, hive)
-    else:
-      for adjacentPoint in hive.getAdjacentPoints(point):
-        piece = hive.getTopPieceAtPoint(adjacentPoint)
-        if piece:
-          kindPossiblePoints = piece.__class__.getPossiblePoints(self, hive)
-          possiblePoints = possiblePoints + filter(lambda x:x not in possiblePoints, kindPossiblePoints)
-
-    return possiblePoints
+  def getMoveCells(self, hive):
+    if self.point.z > 0: # on top: can only move as beetle
+      return BeetlePiece.getMoveCells(self, hive)
+
+    # an adjacent mosquito has no moves of its own to lend
+    possibleCells = set()
+    cellId = hive.getCellId(self.point)
+    for offset in hive.ADJACENT_OFFSETS:
+      piece = hive.getTopPieceAtCell(cellId + offset)
+      if piece and not piece.kind == 'M':
+        possibleCells.update(piece.__class__.getMoveCells(self, hive))
+
+    return possibleCells
+
+
+  def canReachCell(self, hive, cellId):
+    if self.point.z > 0: # on top: can only move as beetle
+      return BeetlePiece.canReachCell(self, hive, cellId)
+
+    # any adjacent kind that can get there will do
+    startCell = hive.getCellId(self.point)
+    lentKinds = set()
+    for offset in hive.ADJACENT_OFFSETS:
+      piece = hive.getTopPieceAtCell(startCell + offset)
+      if piece and not piece.kind == 'M' and not piece.kind in lentKinds:
+        lentKinds.add(piece.kind)
+        if piece.__class__.canReachCell(self, hive, cellId):
+          return True
+
+    return False
 
@@ -0,0 +1,131 @@
+from pieces import Piece, CELL_SHIFT, CELL_HALF
+
+try:
+  import numpy
+except ImportError: # the planes are optional, everything else runs without NumPy
+  numpy = None
+
+
+class BoardPlanes:
+  """
+    An array mirror of a Hive for vectorised features, kept in step by Hive.pickupPiece/putdownPiece (see Hive.enablePlanes).
+    One int8 array of shape (PLANES, SIZE, SIZE) indexed [plane, x - originX, y - originY]:
+      OCCUPANCY 1 where there is a piece
+      COLOR     +1 / -1 for a white / black top piece
+      KIND      1 + the index of the top piece's kind in Piece.KINDSTRING
+      HEIGHT    the number of pieces in the stack
+      QUEENS    +1 / -1 at the white / black queen bee (also under beetles)
+    The window is re-centred on the hive whenever a piece comes within MARGIN of its edge, so the features
+    below never see a piece wrap around. Arrays of many positions stack along a new first axis.
+  """
+  (OCCUPANCY, COLOR, KIND, HEIGHT, QUEENS) = range(5)
+  PLANES = 5
+  SIZE = 32 # wider than a hive of all the pieces can span
+  MARGIN = 2
+  COLOR_VALUES = {'w': 1, 'b': -1}
+
+  def __init__(self, hive):
+    if not numpy:
+      raise ImportError('BoardPlanes needs NumPy')
+    self.hive = hive
+    self.planes = numpy.zeros((BoardPlanes.PLANES, BoardPlanes.SIZE, BoardPlanes.SIZE), dtype=numpy.int8)
+    self.originX = -BoardPlanes.SIZE / 2
+    self.originY = -BoardPlanes.SIZE / 2
+    self.recentre()
+
+
+  def getArray(self):
+    """ a copy of the planes, to keep or stack with other positions' """
+    return self.planes.copy()
+
+
+  def recentre(self):
+    """ centres the window on the hive and fills the planes from its board """
+    board = self.hive.board
+    self.planes.fill(0)
+    if board:
+      xs = [(cellId + CELL_HALF) >> CELL_SHIFT for cellId in board]
+      ys = [cellId - (x << CELL_SHIFT) for cellId, x in zip(board, xs)]
+      self.originX = (min(xs) + max(xs)) / 2 - BoardPlanes.SIZE / 2
+      self.originY = (min(ys) + max(ys)) / 2 - BoardPlanes.SIZE / 2
+    for cellId in board:
+      self._copyCell(cellId)
+
+
+  def updateCell(self, cellId):
+    """ copies the stack at cellId from the board after it changed """
+    x = (cellId + CELL_HALF) >> CELL_SHIFT
+    (i, j) = (x - self.originX, cellId - (x << CELL_SHIFT) - self.originY)
+    (low, high) = (BoardPlanes.MARGIN, BoardPlanes.SIZE - BoardPlanes.MARGIN)
+    if not (low <= i < high and low <= j < high) and cellId in self.hive.board:
+      self.recentre()
+    elif 0 <= i < BoardPlanes.SIZE and 0 <= j < BoardPlanes.SIZE:
+      self._copyCell(cellId)
+
+
+  def _copyCell(self, cellId):
+    x = (cellId + CELL_HALF) >> CELL_SHIFT
+    (i, j) = (x - self.originX, cellId - (x << CELL_SHIFT) - self.originY)
+    planes = self.planes
+    pieces = self.hive.board.get(cellId)
+    if not pieces:
+      planes[:, i, j] = 0
+      return
+
+    topPiece = pieces[-1]
+    planes[BoardPlanes.OCCUPANCY, i, j] = 1
+    planes[BoardPlanes.COLOR, i, j] = BoardPlanes.COLOR_VALUES[topPiece.color]
+    planes[BoardPlanes.KIND, i, j] = Piece.KINDSTRING.index(topPiece.kind) + 1
+    planes[BoardPlanes.HEIGHT, i, j] = len(pieces)
+    planes[BoardPlanes.QUEENS, i, j] = 0
+    for piece in pieces:
+      if piece.kind == 'Q':
+        planes[BoardPlanes.QUEENS, i, j] = BoardPlanes.COLOR_VALUES[piece.color]
+
+
+
+# vectorised features over the planes of one position (PLANES, SIZE, SIZE) or a batch of them (N, PLANES, SIZE, SIZE)
+
+ADJACENT_SHIFTS = ((1, 0), (1, 1), (0, 1), (-1, 0), (-1, -1), (0, -1)) # same order as Hive.ADJACENT_OFFSETS
+NO_DISTANCE = 2 * BoardPlanes.SIZE # the distance to a queen bee that is not on the board
+
+def getAdjacentCounts(planes):
+  """ the number of occupied cells adjacent to each cell """
+  occupancy = planes[..., BoardPlanes.OCCUPANCY, :, :]
+  counts = numpy.zeros(occupancy.shape, dtype=numpy.int8)
+  for dx, dy in ADJACENT_SHIFTS:
+    counts += numpy.roll(numpy.roll(occupancy, -dx, axis=-2), -dy, axis=-1)
+  return counts
+
+
+def getQueenAdjacentCounts(planes):
+  """ (white, black): the number of pieces around each queen bee, per position """
+  counts = getAdjacentCounts(planes)
+  queens = planes[..., BoardPlanes.QUEENS, :, :]
+  return ((counts * (queens == 1)).sum(axis=(-2, -1)), (counts * (queens == -1)).sum(axis=(-2, -1)))
+
+
+def getQueenDistances(planes, color):
+  """ the hex distance from each cell to the queen bee of color (+1 / -1), NO_DISTANCE while it is in the pile """
+  queens = planes[..., BoardPlanes.QUEENS, :, :] == color
+  isPlayed = queens.any(axis=(-2, -1))
+  queenIndex = queens.reshape(queens.shape[:-2] + (-1,)).argmax(axis=-1)
+  dx = numpy.arange(BoardPlanes.SIZE).reshape(BoardPlanes.SIZE, 1) - (queenIndex // BoardPlanes.SIZE)[..., None, None]
+  dy = numpy.arange(BoardPlanes.SIZE).reshape(1, BoardPlanes.SIZE) - (queenIndex % BoardPlanes.SIZE)[..., None, None]
+  distances = (abs(dx) + abs(dy) + abs(dx - dy)) // 2
+  return numpy.where(isPlayed[..., None, None], distances, NO_DISTANCE)
+
+
+def getTropism(planes, color, tables):
+  """
+    The sum over the top pieces of color (+1 / -1) of tables[kind][distance to the opposing queen bee], per position.
+    Distances past the end of a table use its last entry (as Heuristic does with TROPISM_INDEX_MAX).
+  """
+  distances = getQueenDistances(planes, -color)
+  isOwn = planes[..., BoardPlanes.COLOR, :, :] == color
+  kinds = planes[..., BoardPlanes.KIND, :, :]
+  score = 0
+  for kind, table in tables.iteritems():
+    values = numpy.array(table)[numpy.minimum(distances, len(table) - 1)]
+    score = score + (values * (isOwn & (kinds == Piece.KINDSTRING.index(kind) + 1))).sum(axis=(-2, -1))
+  return score
@@ -0,0 +1,101 @@
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+from errors import *
+
+
+class BotProtocol:
+  """
+    The line protocol between the framework and a bot kept running for the whole game (a bot started with --persistent).
+    The bot is started once with the usual --times and --moves of the position so far, then reads one command per line:
+      play <move>   a move was played, by either side (the bot's own moves included), the bot answers ok
+      go <times>    the bot's turn with the time controls so far (see --times), the bot answers with its move
+      quit          the game is over, the bot exits without answering
+    A command the bot can't carry out is answered with 'err <message>' instead.
+  """
+  (PLAY, GO, QUIT) = ('play', 'go', 'quit')
+  (OK, ERROR) = ('ok', 'err')
+
+  def __init__(self, bot, input = sys.stdin, output = sys.stdout):
+    """ bot: has playMove(moveString) and go(timeControlsCsv) returning the move string to play """
+    self.bot = bot
+    self.input = input
+    self.output = output
+
+
+  def run(self):
+    while True:
+      line = self.input.readline()
+      if not line: # the framework is gone
+        break
+
+      (command, separator, argument) = line.strip().partition(' ')
+      if command == BotProtocol.QUIT:
+        break
+
+      try:
+        if command == BotProtocol.PLAY:
+          self.bot.playMove(argument)
+          reply = BotProtocol.OK
+        elif command == BotProtocol.GO:
+          reply = self.bot.go(argument)
+        else:
+          reply = BotProtocol.ERROR + ' unknown command ' + command
+      except (InputError, MoveError) as e:
+        reply = BotProtocol.ERROR + ' ' + e.value
+
+      self.output.write(reply + '\n')
+      self.output.flush()
+
+
+
+class BotProcess:
+  """
+    The framework's end of BotProtocol: a bot process started once and sent commands for the rest of the game.
+    The bot's stderr goes to a temporary file, so it can't fill up a pipe while nobody reads it; readErrorOutput returns what's new.
+  """
+
+  def __init__(self, commandLine):
+    (errorFd, self.errorPath) = tempfile.mkstemp(suffix='.log')
+    try:
+      self.process = subprocess.Popen(shlex.split(commandLine + ' --persistent'), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=errorFd, cwd=None)
+    except:
+      os.remove(self.errorPath)
+      raise
+    finally:
+      os.close(errorFd)
+    self.errorFile = open(self.errorPath, 'rb') # a separate file offset from the bot's, so reading doesn't move its writes
+    self.errorPosition = 0
+
+
+  def send(self, command, argument = ''):
+    """ the bot's reply line, '' if it has exited """
+    try:
+      self.process.stdin.write(command + ' ' + argument + '\n')
+      self.process.stdin.flush()
+    except IOError: # the bot has exited, its stdout is at end of file too
+      pass
+    return self.process.stdout.readline().strip()
+
+
+  def readErrorOutput(self):
+    self.errorFile.seek(self.errorPosition)
+    errorOutput = self.errorFile.read()
+    self.errorPosition += len(errorOutput)
+    return errorOutput
+
+
+  def close(self):
+    """ quits the bot and removes its error output file, even when waiting for the bot is interrupted """
+    try:
+      try:
+        self.process.stdin.write(BotProtocol.QUIT + '\n')
+        self.process.stdin.close()
+      except IOError:
+        pass
+      self.process.wait()
+    finally:
+      self.errorFile.close()
+      os.remove(self.errorPath)
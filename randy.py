@@ -2,6 +2,7 @@ import argparse
 import random
 import sys
 from game import *
+from protocol import *
 
 
 class OpeningBook():
@@ -136,7 +137,12 @@ class Randy():
   """ A bot that will play random moves in Hive """
   def __init__(self, args):
     self.args = self._parseArgs(args)
-    self.game = Game('' , '', self.args['times'], self.args['moves'], self.args['expansions'])
+    self.diskCache = None
+    if self.args['cache']:
+      self.diskCache = DiskCache(self.args['cache'])
+      self.game = Game.fromDiskCache(self.diskCache, 'randy', '' , '', self.args['times'], self.args['moves'], self.args['expansions'], self.args['trusted'])[0]
+    else:
+      self.game = Game('' , '', self.args['times'], self.args['moves'], self.args['expansions'], self.args['trusted'])
     self.player = self.game.currentPlayer
     self.bestMove = None
 
@@ -146,7 +152,10 @@ class Randy():
     parser.add_argument(args[0], default='')
     parser.add_argument('--times', default='30000,0,0') # game time, white used, black used (ms)
     parser.add_argument('--moves', default='') # 1. wS1, 2. bG1 -wS1, 3. wQ wS1/, ...
+    parser.add_argument('--trusted', action='store_true') # the moves are known to be legal: replay them without validation
+    parser.add_argument('--persistent', action='store_true') # keep running for the whole game, reading BotProtocol commands from stdin
     parser.add_argument('--expansions', default='') # LMD
+    parser.add_argument('--cache', default='') # directory to keep the position in between turns
     args = parser.parse_args(args)
     return vars(args)
 
@@ -154,18 +163,41 @@ class Randy():
   def run(self):
     #self.game.printBoard()
 
+    if self.args['persistent']:
+      BotProtocol(self).run()
+    else:
+      self.findMove()
+      sys.stdout.write(self.getMoveString())
+
+
+  def findMove(self):
     self.bestMove = OpeningBook(self.game).findMove()
     if not self.bestMove:
       self.bestMove = MoveSearch(self.game).findMove()
+      if self.diskCache:
+        self.game.saveToDiskCache(self.diskCache, 'randy')
+    return self.bestMove
 
-    self.printMove()
 
+  def playMove(self, moveString):
+    """ BotProtocol play """
+    if self.args['trusted']:
+      self.game.playTrustedMove(moveString)
+    else:
+      self.game.playMove(moveString)
+
+
+  def go(self, timeControlsCsv):
+    """ BotProtocol go """
+    self.game.readTimeControls(timeControlsCsv)
+    self.findMove()
+    return self.getMoveString()
 
-  def printMove(self):
+
+  def getMoveString(self):
     if not self.bestMove:
-      sys.stdout.write('pass')
-    else:
-      sys.stdout.write(self.game.getMoveNotation(self.bestMove))
+      return 'pass'
+    return self.game.getMoveNotation(self.bestMove)
 
 
 
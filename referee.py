@@ -0,0 +1,186 @@
+import argparse
+import errno
+import os
+import select
+import shlex
+import subprocess
+import sys
+from time import time
+from errors import *
+from game import *
+from framework import Framework
+
+
+class Match:
+  """ One game of a Referee: the Game, its play by play so far and the bot process of the move being waited for """
+
+  def __init__(self, number, game):
+    self.number = number
+    self.game = game
+    self.playByPlay = []
+    self.error = ''
+    self.process = None
+    self.stdoutChunks = []
+    self.stderrChunks = []
+    self.openPipes = {} # file descriptor => the chunks read from it, until it is at end of file
+    self.startTime = 0
+    self.deadline = 0
+
+
+
+class Referee():
+  """
+    Runs many games between two bots at once from a single process. The bots are started for every move as
+    Framework.readMove does, and select reads their stdout and stderr as it comes, so no game waits on another.
+    A bot that doesn't answer within --timeout, or runs out of game time, is killed and loses. POSIX only: select doesn't take pipes on Windows.
+  """
+  READ_SIZE = 65536
+  EXIT_POLL_INTERVAL = 0.01 # s between checks on a bot that has closed its output but not exited yet
+  WINNER_NAMES = {Game.WINNER_WHITE: 'White wins', Game.WINNER_BLACK: 'Black wins', Game.WINNER_DRAW: 'Draw'}
+
+  def __init__(self, args):
+    self.args = self._parseArgs(args)
+
+
+  def _parseArgs(self, args):
+    parser = argparse.ArgumentParser(prog='referee', argument_default='')
+    parser.add_argument(args[0], default='')
+    parser.add_argument('--white', required=True)
+    parser.add_argument('--black', required=True)
+    parser.add_argument('--games', type=int, default=8) # number of games to play
+    parser.add_argument('--jobs', type=int, default=4) # number of games played at once
+    parser.add_argument('--timeout', type=int, default=60000) # ms a bot may take for a move
+    parser.add_argument('--times', default='600000,0,0') # game time, white used, black used (ms)
+    parser.add_argument('--moves', default='') # 1. wS1, 2. bG1 -wS1, 3. wQ wS1/, ...
+    parser.add_argument('--expansions', default='') # LM
+    parser.add_argument('--trusted', action='store_true') # pass --trusted to the bots (they must accept it)
+    args = parser.parse_args(args)
+    return vars(args)
+
+
+  def run(self):
+    """ the results of every game, each in the shape Framework.run returns """
+    self.devnull = open(os.devnull) # the bots' stdin
+    results = [None] * self.args['games']
+    waiting = range(self.args['games'])
+    running = []
+
+    while waiting or running:
+      while waiting and len(running) < self.args['jobs']:
+        match = Match(waiting.pop(0), Game(self.args['white'], self.args['black'], self.args['times'], self.args['moves'], self.args['expansions']))
+        running.append(match)
+
+      for match in running[:]:
+        if match.process:
+          continue
+        if match.error or match.game.isGameOver():
+          running.remove(match)
+          results[match.number] = self.finish(match)
+        else:
+          self.startMove(match)
+
+      self.readOutput(running)
+
+    self.devnull.close()
+    return results
+
+
+  def startMove(self, match):
+    commandLine = Framework.getBotCommandLine(match.game, self.args['trusted'])
+    match.startTime = time()
+    timeLeft = match.game.getTimeLeft()
+    match.deadline = match.startTime + min(self.args['timeout'], timeLeft if timeLeft is not None else self.args['timeout']) / 1000.0
+    try:
+      match.process = subprocess.Popen(shlex.split(commandLine), stdin=self.devnull, stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
+    except OSError:
+      sys.stderr.write('game %d: %s process failed to execute\n' % (match.number, match.game.currentPlayer.bot))
+      match.error = match.game.currentPlayer.color
+      return
+
+    match.stdoutChunks = []
+    match.stderrChunks = []
+    match.openPipes = {match.process.stdout.fileno(): match.stdoutChunks, match.process.stderr.fileno(): match.stderrChunks}
+
+
+  def readOutput(self, running):
+    """
+      reads whatever the bots have written, waiting until there is some or the first of them is out of time.
+      A bot that has closed its output is polled until it exits, never waited for, so one that lingers can't stall the others.
+    """
+    matches = [match for match in running if match.process]
+    if not matches:
+      return
+
+    pipes = dict([(fd, match) for match in matches for fd in match.openPipes])
+    timeout = max(0, min([match.deadline for match in matches]) - time())
+    if len(set(pipes.itervalues())) < len(matches):
+      timeout = min(timeout, Referee.EXIT_POLL_INTERVAL)
+    try:
+      readable = select.select(pipes.keys(), [], [], timeout)[0]
+    except select.error as e:
+      if e.args[0] == errno.EINTR:
+        return
+      raise
+
+    for fd in readable:
+      match = pipes[fd]
+      chunk = os.read(fd, Referee.READ_SIZE)
+      if chunk:
+        match.openPipes[fd].append(chunk)
+      else:
+        del match.openPipes[fd]
+
+    now = time()
+    for match in matches:
+      if not match.openPipes:
+        usage = Framework.waitForBot(match.process, True)
+        if usage:
+          self.endMove(match, usage)
+          continue
+      if now > match.deadline:
+        match.process.kill() # not reaped yet, so the pid is still the bot's
+        sys.stderr.write('game %d: %s ran out of time\n' % (match.number, match.game.currentPlayer.color))
+        self.endMove(match, Framework.waitForBot(match.process), match.game.currentPlayer.color)
+
+
+  def endMove(self, match, usage, error = ''):
+    """ plays the move of the bot that has exited and been reaped with usage (cpu ms, peak memory KB), as Framework.run does """
+    moveTime = round((time() - match.startTime) * 1000)
+    match.process.stdout.close()
+    match.process.stderr.close()
+    (cpuTime, peakMemory) = usage
+    match.process = None
+    match.game.currentPlayer.timeUsed += moveTime
+
+    moveString = ''.join(match.stdoutChunks)
+    if not error and match.game.isOutOfTime():
+      sys.stderr.write('game %d: %s ran out of time\n' % (match.number, match.game.currentPlayer.color))
+      error = match.game.currentPlayer.color
+    if not error:
+      try:
+        match.game.playMove(moveString)
+      except (InputError, MoveError) as e:
+        sys.stderr.write('game %d: %s plays %s: %s\n' % (match.number, match.game.currentPlayer.color, moveString, e.value))
+        error = match.game.currentPlayer.color
+
+    match.error = error
+    if not error:
+      match.playByPlay.append({
+        'move_number': match.game.turnNumber - 1,
+        'move_string': moveString,
+        'move_time': moveTime,
+        'cpu_time': cpuTime,
+        'peak_memory': peakMemory,
+        'error_output': ''.join(match.stderrChunks),
+      })
+
+
+  def finish(self, match):
+    winner = Framework.getWinner(match.game, match.error)
+    sys.stdout.write('game %d: %s after %d moves\n' % (match.number, Referee.WINNER_NAMES.get(winner, 'Unfinished'), match.game.turnNumber - 1))
+    return Framework.getResults(match.game, self.args['expansions'], winner, match.error, match.playByPlay)
+
+
+
+if __name__ == "__main__":
+  Referee(sys.argv).run()
@@ -1,38 +1,44 @@
 import random
-from pieces import Point
+from pieces import Piece, CELL_SHIFT, CELL_HALF
 
 class Zobrist:
-  """ 
-    This is a modification of Zobrist keys: they are lazily generated into a dictionary 
-    since the number of different hexes a piece can land throughout the game on is indeterminate. 
   """
+    Zobrist keys drawn from a fixed seed, so a state hashes the same in every process and on every machine.
+    Cells wrap around a WINDOW x WINDOW window, which is wider than a hive of all the pieces can grow.
+    The keys come in one block per piece kindId and height, indexed by the cell's place in the window. A block is
+    drawn on first use from its own seed, so the keys don't depend on which blocks a game happens to touch first.
+  """
+  SEED = 0x48697665
+  WINDOW_BITS = 5
+  WINDOW_MASK = (1 << WINDOW_BITS) - 1
+  HEIGHTS = 8 # the most pieces a stack can hold (4 beetles and 2 mosquitoes on top of a piece) rounded up
+  BLOCK_KEYS = 1 << (2 * WINDOW_BITS) # keys for one color, kind and height
 
-  def __init__(self, numberOfPieces):
-    self.zobristKeys = [[dict() for y in range(numberOfPieces)] for x in range(2)]
-    self.sideKey = self._generateRandomNumber()
-    self.currentState = 0L
-
-
-  def _getDictKey(self, point = Point(None, None, None)):
-    return str(point.x) + ',' +  str(point.y) + ',' + str(point.z)
-
+  # signed 64 bit keys stay plain ints on 64 bit builds
+  SIDE_KEY = random.Random(SEED).getrandbits(64) - 2**63
+  BLOCKS = [None] * (len(Piece.COLORSTRING) * len(Piece.KINDSTRING) * HEIGHTS) # kindId * HEIGHTS + z => keys, None until used
 
-  def _getZobristKey(self, colorIndex, kindIndex, point = Point(None, None, None)):
-    dictKey = self._getDictKey(point)
-    if not self.zobristKeys[colorIndex][kindIndex].has_key(dictKey):
-      self.zobristKeys[colorIndex][kindIndex][dictKey] = self._generateRandomNumber()
-    return self.zobristKeys[colorIndex][kindIndex][dictKey]
+  def __init__(self):
+    self.currentState = 0
 
 
-  def _generateRandomNumber(self): # is this sufficient?
-    return random.randint(1, 2**32)
+  @staticmethod
+  def getBlock(kindId, z):
+    """ the keys of a piece kindId at height z """
+    blockIndex = kindId * Zobrist.HEIGHTS + z
+    block = Zobrist.BLOCKS[blockIndex]
+    if block is None:
+      blockRandom = random.Random((Zobrist.SEED << 16) + (kindId << 8) + z)
+      block = Zobrist.BLOCKS[blockIndex] = [blockRandom.getrandbits(64) - 2**63 for i in xrange(Zobrist.BLOCK_KEYS)]
+    return block
 
 
   def changeSide(self):
-    self.currentState = self.currentState ^ self.sideKey
-
+    self.currentState ^= Zobrist.SIDE_KEY
 
-  def updateState(self, piece):
-    key = self._getZobristKey(piece.getColorIndex(), piece.getKindIndex(), piece.point)
-    self.currentState = self.currentState ^ key
 
+  def updateState(self, piece, cellId):
+    """ toggles the piece in or out at its point (the cell id is the one of piece.point) """
+    window = ((((cellId + CELL_HALF) >> CELL_SHIFT) & Zobrist.WINDOW_MASK) << Zobrist.WINDOW_BITS) | (cellId & Zobrist.WINDOW_MASK)
+    block = Zobrist.BLOCKS[piece.kindId * Zobrist.HEIGHTS + piece.point.z] or Zobrist.getBlock(piece.kindId, piece.point.z)
+    self.currentState ^= block[window]